@@ -1,52 +1,306 @@
-from flask import Flask, request, jsonify
-from jwt_utils import build_token
+from flask import Flask, Response, request, jsonify, make_response, send_file
+from jwt_utils import build_token, verify_token, JwtError
 from flask_cors import CORS
 from werkzeug.exceptions import Unauthorized
-import hashlib
-from services.question_service import create_question, get_question_by_id_from_db, get_question_by_position,delete_question_by_position,delete_question_by_id,delete_all_questions,update_question_by_id,delete_all_participations,get_quiz_info_handler,create_participation_handler,get_all_questions
+from datetime import datetime
+import json
+import logging
+import os
+import re
+from services.question_service import create_question, get_question_by_id_from_db, get_question_by_position,delete_question_by_position,delete_question_by_id,delete_all_questions,update_question_by_id,delete_all_participations,get_quiz_info_handler,create_participation_handler,get_all_questions,get_quiz_cache_stats,reorder_questions,get_question_image,iter_participations,get_quiz_version,get_participations_version,get_all_questions_json,get_question_json_by_position,get_question_json_by_id,find_nearest_answer,get_quiz_bundle_json
 from models.question_model import Question, question_to_json
 from services.rebuild_service import rebuild_database
+from services.migration_service import run_migrations
+from services.cache_service import BOOT_ID
+from services.bulk_service import import_questions, import_participations, iter_questions_export
+from services.json_service import dumps
+from services.geo_service import valid_coordinates
+from services.auth_service import verify_password, login_rate_limiter
+from services.session_service import start_session, answer_session_question, finalize_session, get_session_stats, SessionConflict
+from services.metrics_service import METRICS_ENABLED, SERVER_TIMING, start_request, finish_request, server_timing, render_metrics
+from services.image_service import VARIANT_NAMES
+from services.compression_service import COMPRESS_MIN_SIZE, COMPRESSIBLE_TYPES, compress, negotiate
+from services.db_service import QuizRetired, current_database, databases, use_database, use_quiz
+from services.quiz_service import QuizExists, QuizInUse, init_catalog, get_quiz, list_quizzes, create_quiz, delete_quiz
+from services.stats_service import get_quiz_stats
 from functools import wraps
 
+logging.basicConfig(
+    level=os.environ.get("QUIZ_LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+QUIZ_PATH = re.compile(r"^/quizzes/([^/]+)(/.+)$")
+
+class QuizPrefixMiddleware:
+    """
+    Serves /quizzes/<id>/<route> with the routes of the default quiz, for
+    quiz <id>: every endpoint exists once, whatever the number of quizzes.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        match = QUIZ_PATH.match(environ.get('PATH_INFO', ''))
+        if match:
+            environ['quiz.id'] = match.group(1)
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + match.group(0)[:-len(match.group(2))]
+            environ['PATH_INFO'] = match.group(2)
+        return self.wsgi_app(environ, start_response)
+
 app = Flask(__name__)
+app.wsgi_app = QuizPrefixMiddleware(app.wsgi_app)
 CORS(app, origins=["http://localhost:3000"])
 
+run_migrations()
+init_catalog()
+
+@app.before_request
+def enter_quiz():
+    # Unprefixed routes serve the default quiz, without entering it
+    quiz_id = request.environ.get('quiz.id')
+    if quiz_id is None:
+        return None
+    if get_quiz(quiz_id) is None:
+        return jsonify({"error": "Quiz not found"}), 404
+    context = use_quiz(quiz_id)
+    try:
+        context.__enter__()
+    except QuizRetired as qr:
+        return jsonify({"error": str(qr)}), 503
+    request.environ['quiz.context'] = context
+    return None
+
+@app.teardown_request
+def leave_quiz(exc):
+    context = request.environ.pop('quiz.context', None)
+    if context is not None:
+        context.__exit__(None, None, None)
+
+def quiz_stream(generate):
+    """
+    Body of a streamed response: it is iterated after the request ended,
+    possibly chunk by chunk from other threads, so each chunk is produced
+    with the quiz of the request current.
+    """
+    quiz_id = current_database().id
+    def stream():
+        # Acquired on the first chunk: a body never iterated holds nothing
+        database = databases.acquire(quiz_id)
+        try:
+            chunks = generate()
+            while True:
+                with use_database(database):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            databases.release(database)
+    return stream()
+
 def require_auth(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        token = request.headers.get('Authorization', '')
+        if token.startswith('Bearer '):
+            token = token[len('Bearer '):]
         if not token:
             return jsonify({"error": "Unauthorized"}), 401
+
+        try:
+            verify_token(token)
+        except JwtError as e:
+            return jsonify({"error": e.message}), 401
         return f(*args, **kwargs)
     return decorated_function
 
+def conditional(version):
+    """
+    Adds a strong ETag built from the content version to 200 responses and
+    answers a matching If-None-Match with 304, without calling the view.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Read before the view runs: a concurrent write can only make
+            # the ETag older than the body, never newer
+            # Each content encoding is a representation of its own
+            encoding = response_encoding()
+            etag = f"{BOOT_ID}-{version()}" + (f"-{encoding}" if encoding else "")
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            response.vary.add('Accept-Encoding')
+            return response
+        return decorated_function
+    return decorator
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_metrics():
+        # Route template, not the path: one series per endpoint
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request.environ['quiz.metrics'] = start_request(route)
+
+    @app.after_request
+    def finish_request_metrics(response):
+        stats = request.environ.pop('quiz.metrics', None)
+        if stats is None:
+            return response
+        # Streamed bodies have no length: their size and the time spent
+        # streaming them are not measured
+        duration = finish_request(stats, request.method, response.status_code, response.content_length)
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing(stats, duration)
+        return response
+
+@app.after_request
+def compress_response(response):
+    # Bodies not compressed by their view are compressed per request. Runs
+    # before the metrics hook, which then records the compressed size.
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = response_encoding()
+    if encoding and response.content_length >= COMPRESS_MIN_SIZE:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def response_encoding():
+    return negotiate(request.accept_encodings)
+
+def json_payload(data, status=200):
+    # Pre-serialized JSON bytes, see services/json_service.py
+    return app.response_class(data, status=status, mimetype='application/json')
+
+def encoded_json_payload(payload):
+    # (body, encoding) from the question service, compressed once per version
+    body, encoding = payload
+    response = json_payload(body)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def quiz_version():
+    return f"q{get_quiz_version()}"
+
+def quiz_info_version():
+    return f"q{get_quiz_version()}p{get_participations_version()}"
+
 @app.route('/')
 def hello_world():
 	x = 'world'
 	return f"Hello, {x}"
 
+LEADERBOARD_MAX_LIMIT = 1000
+
+@app.route('/quizzes', methods=['GET'])
+def get_quizzes():
+    return jsonify(list_quizzes()), 200
+
+@app.route('/quizzes/<quiz_id>', methods=['GET'])
+def get_quiz_by_id(quiz_id):
+    quiz = get_quiz(quiz_id)
+    if quiz is None:
+        return jsonify({"error": "Quiz not found"}), 404
+    return jsonify(quiz), 200
+
+@app.route('/quizzes', methods=['POST'])
+@require_auth
+def post_quiz():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Missing JSON"}), 400
+
+    try:
+        return jsonify(create_quiz(data.get('id'), data.get('title'))), 201
+    except QuizExists as qe:
+        return jsonify({"error": str(qe)}), 409
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/quizzes/<quiz_id>', methods=['DELETE'])
+@require_auth
+def handle_delete_quiz(quiz_id):
+    try:
+        if not delete_quiz(quiz_id):
+            return jsonify({"error": "Quiz not found"}), 404
+        return '', 204
+    except QuizInUse as qu:
+        return jsonify({"error": str(qu)}), 409
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/quiz-info', methods=['GET'])
+@conditional(quiz_info_version)
 def GetQuizInfo():
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', default=0, type=int)
+    cursor = request.args.get('cursor')
+    player_name = request.args.get('playerName')
+
+    after = None
+    if cursor:
+        try:
+            score, participation_id = cursor.split(':')
+            after = (int(score), int(participation_id))
+        except ValueError:
+            return jsonify({"error": "Invalid 'cursor' parameter"}), 400
+
+    if limit is not None:
+        limit = max(0, min(limit, LEADERBOARD_MAX_LIMIT))
+
     try:
-        data = get_quiz_info_handler()
+        data = get_quiz_info_handler(limit, max(0, offset), after, player_name)
         return jsonify(data), 200
     except Exception as e:
-        print(f"Error in /quiz-info: {e}")
+        app.logger.exception("Error in /quiz-info: %s", e)
         return jsonify({"error": "Internal Server Error"}), 500
 
+@app.route('/quiz-info/export', methods=['GET'])
+def export_quiz_info():
+    def generate():
+        yield '['
+        for index, participation in enumerate(iter_participations()):
+            yield (',' if index else '') + json.dumps(participation)
+        yield ']'
+
+    return Response(quiz_stream(generate), mimetype='application/json')
 
 @app.route("/login", methods=["POST"])
 def login():
     payload = request.get_json()
 
-    if not payload or 'password' not in payload:
+    if not isinstance(payload, dict) or not isinstance(payload.get('password'), str):
         return jsonify({"error": "Password required"}), 400
 
-    tried_password = payload['password'].encode('utf-8')
-    hashed = hashlib.md5(tried_password).digest()
-    
-    EXPECTED_HASH=b'\xd2x\x07{\xbf\xe7(Z\x14MK[\x11\xad\xb9\xcf'
-    if hashed == EXPECTED_HASH:
+    retry_after = login_rate_limiter.attempt(request.remote_addr)
+    if retry_after:
+        return jsonify({"error": "Too many login attempts"}), 429, {"Retry-After": str(int(retry_after) + 1)}
+
+    if not login_rate_limiter.acquire():
+        return jsonify({"error": "Too many login attempts"}), 429, {"Retry-After": "1"}
+    try:
+        valid = verify_password(payload['password'])
+    finally:
+        login_rate_limiter.release()
+
+    if valid:
         token = build_token()
         return jsonify({"token": token})
     else:
@@ -62,38 +316,134 @@ def post_question():
     try:
         new_question_id = create_question(data)
         return jsonify({"message": "Question created", "id": new_question_id}), 200
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _read_ndjson(stream):
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            raise ValueError(f"Invalid JSON on line {line_number}")
+
+@app.route('/questions/bulk', methods=['POST'])
+@require_auth
+def post_questions_bulk():
+    mode = request.args.get('mode', 'append')
+    if mode not in ('append', 'replace'):
+        return jsonify({"error": "Invalid 'mode' parameter"}), 400
+
+    try:
+        count = import_questions(_read_ndjson(request.stream), replace=(mode == 'replace'))
+        return jsonify({"message": "Questions imported", "count": count}), 200
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/participations/bulk', methods=['POST'])
+@require_auth
+def post_participations_bulk():
+    try:
+        count = import_participations(_read_ndjson(request.stream))
+        return jsonify({"message": "Participations imported", "count": count}), 200
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/questions/export', methods=['GET'])
+@require_auth
+def export_questions():
+    def generate():
+        for question in iter_questions_export():
+            yield dumps(question) + b'\n'
+
+    return Response(quiz_stream(generate), mimetype='application/x-ndjson')
+
 @app.route('/questions', methods=['GET'])
+@conditional(quiz_version)
 def get_questions():
     try:
         position = request.args.get('position', type=int)
         
         if position is not None:
-            question = get_question_by_position(position)
-            if not question:
+            payload = get_question_json_by_position(position, response_encoding())
+            if payload is None:
                 return jsonify({"error": "Question not found"}), 404
-            return jsonify(question_to_json(question)), 200
+            return encoded_json_payload(payload)
         else:
-            questions = get_all_questions()
-            return jsonify([question_to_json(q) for q in questions]), 200
+            return encoded_json_payload(get_all_questions_json(response_encoding()))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/questions/<int:questionId>', methods=['GET'])
+@conditional(quiz_version)
 def get_question_by_id(questionId):
     try:
-        question = get_question_by_id_from_db(questionId) 
-        if not question:
+        payload = get_question_json_by_id(questionId, response_encoding())
+        if payload is None:
             return jsonify({"error": "Question not found"}), 404
 
-        return jsonify(question_to_json(question)), 200
+        return encoded_json_payload(payload)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/quiz/bundle', methods=['GET'])
+@conditional(quiz_version)
+def get_quiz_bundle():
+    start = request.args.get('from', default=1, type=int)
+    count = request.args.get('count', type=int)
+    if start < 1 or (count is not None and count < 0):
+        return jsonify({"error": "Invalid 'from' or 'count' parameter"}), 400
+
+    try:
+        return encoded_json_payload(get_quiz_bundle_json(start, count, response_encoding()))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/questions/<int:question_id>/image', methods=['GET'])
+def get_question_image_file(question_id):
+    try:
+        variant = request.args.get('size', 'full')
+        if variant not in VARIANT_NAMES:
+            return jsonify({"error": f"size must be one of {', '.join(VARIANT_NAMES)}"}), 400
+
+        # Answer revalidations from the snapshot, without reading the image
+        question = get_question_by_id_from_db(question_id)
+        if question and question.image_hash and request.if_none_match.contains(f"{question.image_hash}-{variant}"):
+            return '', 304, {"ETag": f'"{question.image_hash}-{variant}"'}
+
+        row = get_question_image(question_id, variant)
+        if not row:
+            return jsonify({"error": "Image not found"}), 404
+
+        path, mime_type, image_hash, image_updated_at = row
+        # Versioned URLs (?v=<hash prefix>) never change content. The file is
+        # streamed by the server's file wrapper (sendfile where supported),
+        # never read into memory.
+        versioned = request.args.get('v') == image_hash[:16]
+        return send_file(
+            path,
+            mimetype=mime_type,
+            etag=f"{image_hash}-{variant}",
+            last_modified=datetime.fromisoformat(image_updated_at) if image_updated_at else None,
+            max_age=31536000 if versioned else None,
+            conditional=True
+        )
+
+    except FileNotFoundError:
+        return jsonify({"error": "Image not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/questions', methods=['GET'])
 def get_question():
     try:
@@ -124,6 +474,23 @@ def update_question(question_id):
         if not updated:
             return jsonify({"error": "Question not found"}), 404
         return jsonify({"message": "Question updated"}), 204
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/questions/order', methods=['PUT'])
+@require_auth
+def handle_reorder_questions():
+    data = request.get_json()
+    if not isinstance(data, list) or not all(isinstance(question_id, int) for question_id in data):
+        return jsonify({"error": "Expected a JSON list of question ids"}), 400
+
+    try:
+        reorder_questions(data)
+        return '', 204
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -176,6 +543,31 @@ def handle_delete_all_participations():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+@app.route('/geo/nearest', methods=['GET'])
+def get_nearest_answer():
+    latitude = request.args.get('latitude', type=float)
+    longitude = request.args.get('longitude', type=float)
+    if latitude is None or longitude is None or not valid_coordinates(latitude, longitude):
+        return jsonify({"error": "Missing or invalid 'latitude'/'longitude' parameters"}), 400
+
+    try:
+        found = find_nearest_answer(latitude, longitude)
+        if found is None:
+            return jsonify({"error": "No answer with coordinates"}), 404
+
+        question, answer, distance = found
+        return jsonify({
+            "questionId": question.id,
+            "position": question.position,
+            "text": answer.text,
+            "latitude": answer.latitude,
+            "longitude": answer.longitude,
+            "distanceKm": round(distance, 3)
+        }), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/participations', methods=['POST'])
 def create_participation():
     try:
@@ -194,9 +586,104 @@ def create_participation():
         return jsonify({"error": str(ve)}), 400
 
     except Exception as e:
-        print(f"Error in POST /participations: {e}")
+        app.logger.exception("Error in POST /participations: %s", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route('/sessions', methods=['POST'])
+def post_session():
+    json_data = request.get_json(silent=True)
+    if not isinstance(json_data, dict) or not json_data.get('playerName'):
+        return jsonify({"error": "Missing playerName"}), 400
+
+    try:
+        return jsonify(start_session(json_data['playerName'])), 200
+    except Exception as e:
+        app.logger.exception("Error in POST /sessions: %s", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route('/sessions/<session_id>/answers', methods=['POST'])
+def post_session_answer(session_id):
+    json_data = request.get_json(silent=True)
+    if not isinstance(json_data, dict) or not isinstance(json_data.get('position'), int) or 'answer' not in json_data:
+        return jsonify({"error": "Missing position or answer"}), 400
+
+    try:
+        result = answer_session_question(session_id, json_data['position'], json_data['answer'])
+        if result is None:
+            return jsonify({"error": "Session not found or expired"}), 404
+        return jsonify(result), 200
+    except SessionConflict as sc:
+        return jsonify({"error": str(sc)}), 409
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        app.logger.exception("Error in POST /sessions/answers: %s", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route('/sessions/<session_id>/finalize', methods=['POST'])
+def post_session_finalize(session_id):
+    try:
+        result = finalize_session(session_id)
+        if result is None:
+            return jsonify({"error": "Session not found or expired"}), 404
+        return jsonify(result), 200
+    except SessionConflict as sc:
+        return jsonify({"error": str(sc)}), 409
+    except Exception as e:
+        app.logger.exception("Error in POST /sessions/finalize: %s", e)
         return jsonify({"error": "Internal Server Error"}), 500
 
+@app.route('/sessions/stats', methods=['GET'])
+@require_auth
+def session_stats():
+    return jsonify(get_session_stats()), 200
+
+STATS_MAX_PERIODS = 1000
+
+@app.route('/stats', methods=['GET'])
+@require_auth
+@conditional(quiz_info_version)
+def get_stats():
+    try:
+        return jsonify(get_quiz_stats().scores()), 200
+    except Exception as e:
+        app.logger.exception("Error in /stats: %s", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route('/stats/questions', methods=['GET'])
+@require_auth
+@conditional(quiz_info_version)
+def get_question_stats():
+    try:
+        return jsonify(get_quiz_stats().questions(get_all_questions())), 200
+    except Exception as e:
+        app.logger.exception("Error in /stats/questions: %s", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route('/stats/activity', methods=['GET'])
+@require_auth
+@conditional(quiz_info_version)
+def get_activity_stats():
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in ('hour', 'day'):
+        return jsonify({"error": "bucket must be hour or day"}), 400
+    limit = request.args.get('limit', default=48 if bucket == 'hour' else 30, type=int)
+
+    try:
+        return jsonify(get_quiz_stats().activity(bucket, max(1, min(limit, STATS_MAX_PERIODS)))), 200
+    except Exception as e:
+        app.logger.exception("Error in /stats/activity: %s", e)
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route('/cache-stats', methods=['GET'])
+@require_auth
+def cache_stats():
+    return jsonify(get_quiz_cache_stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/rebuild-db', methods=['POST'])
 @require_auth
 def rebuild_db_endpoint():
@@ -204,7 +691,7 @@ def rebuild_db_endpoint():
         rebuild_database()
         return "Ok", 200
     except Exception as e:
-        print("Error rebuilding DB:", e)
+        app.logger.exception("Error rebuilding DB: %s", e)
         return jsonify({"error": "Failed to rebuild database"}), 500
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+import os
+from a2wsgi import WSGIMiddleware
+from app import app
+
+# The Flask views and their SQLite calls are blocking: they run on a bounded
+# thread pool while the event loop keeps serving connections.
+ASGI_WORKERS = int(os.environ.get("QUIZ_ASGI_WORKERS", "32"))
+
+application = WSGIMiddleware(app, workers=ASGI_WORKERS)
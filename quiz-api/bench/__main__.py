@@ -0,0 +1,172 @@
+"""
+Runs the benchmark suite, each scenario in a fresh process on its own
+temporary database, and compares the results with a saved baseline:
+
+    python -m bench                          # everything, results in bench-results.json
+    python -m bench --quick scoring rank     # a subset, with smaller sizes
+    python -m bench --save-baseline          # record bench-baseline.json
+    python -m bench --baseline bench-baseline.json --tolerance 0.25
+
+Exits with status 1 when a metric regressed by more than the tolerance or a
+scenario failed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from bench.harness import API_DIR
+
+# (run name, scenario, params, environment)
+RUNS = [
+    ("player_flow", "player_flow", {}, {}),
+    ("player_flow[metrics_off]", "player_flow", {}, {"QUIZ_METRICS": "0"}),
+    ("player_flow_http", "player_flow_http", {}, {}),
+    ("session_flow", "session_flow", {}, {}),
+    ("bundle", "bundle", {}, {}),
+    ("admin_flow", "admin_flow", {}, {}),
+    ("auth", "auth", {}, {}),
+    ("scoring", "scoring", {}, {}),
+    ("geo_scoring", "geo_scoring", {}, {}),
+    ("queries", "queries", {}, {"QUIZ_SERVER_TIMING": "1"}),
+    ("query_plans", "query_plans", {}, {}),
+    ("concurrent_reads", "concurrent_reads", {}, {}),
+    ("reorder", "reorder", {}, {}),
+    ("rank", "rank", {}, {}),
+    ("conditional_get", "conditional_get", {}, {}),
+    ("serving_modes", "serving_modes", {}, {}),
+    ("submissions[sync]", "submissions", {}, {}),
+    ("submissions[batch_50]", "submissions", {}, {"QUIZ_WRITE_BEHIND": "1", "QUIZ_WRITE_BATCH_SIZE": "50"}),
+    ("submissions[batch_200]", "submissions", {}, {"QUIZ_WRITE_BEHIND": "1", "QUIZ_WRITE_BATCH_SIZE": "200"}),
+    ("submissions[batch_1000]", "submissions", {}, {"QUIZ_WRITE_BEHIND": "1", "QUIZ_WRITE_BATCH_SIZE": "1000"}),
+    ("bulk_roundtrip", "bulk_roundtrip", {}, {}),
+    ("serialization", "serialization", {}, {}),
+    ("image_ingest", "image_ingest", {}, {}),
+    ("image_ingest[inline]", "image_ingest", {}, {"QUIZ_IMAGE_WORKERS": "0"}),
+    ("image_storage", "image_storage", {}, {}),
+    ("compression", "compression", {}, {}),
+    ("tenancy", "tenancy", {}, {}),
+    ("stats", "stats", {}, {}),
+]
+
+# Smaller sizes for a fast local check
+QUICK_PARAMS = {
+    "player_flow": {"flows": 30},
+    "player_flow_http": {"duration": 2.0},
+    "session_flow": {"flows": 20},
+    "bundle": {"rounds": 10},
+    "admin_flow": {"questions": 200, "rounds": 10},
+    "auth": {"requests": 500},
+    "scoring": {"sizes": [10, 100], "submissions": 50},
+    "query_plans": {"participations": 1000},
+    "geo_scoring": {"submissions": 300},
+    "concurrent_reads": {"duration": 1.0},
+    "reorder": {"sizes": [1000]},
+    "rank": {"sizes": [1000, 100000], "lookups": 5000},
+    "conditional_get": {"duration": 1.5},
+    "serving_modes": {"duration": 2.0},
+    "bulk_roundtrip": {"questions": 2000},
+    "serialization": {"questions": 2000},
+    "image_ingest": {"images": 3, "side": 1200},
+    "image_storage": {"questions": 50, "requests": 20},
+    "compression": {"sizes": [20], "requests": 50},
+    "tenancy": {"questions": 50, "duration": 1.0, "quizzes": 30, "max_open": 8},
+    "stats": {"sizes": [1000, 20000], "reads": 60},
+}
+
+HIGHER_IS_BETTER = ("_per_s",)
+LOWER_IS_BETTER = ("_ms", "_us", "_kb")
+
+
+def run_scenario(scenario, params, env):
+    completed = subprocess.run(
+        [sys.executable, "-m", "bench.scenarios", scenario, json.dumps(params)],
+        cwd=API_DIR, env=dict(os.environ, QUIZ_LOG_LEVEL="WARNING", **env),
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of regression messages
+    """
+    regressions = []
+    for run, metrics in results.items():
+        for metric, value in metrics.items():
+            if (metric == "errors" or metric.endswith("_errors")) and value:
+                regressions.append(f"{run}: {metric} = {value}")
+
+            reference = baseline.get(run, {}).get(metric)
+            if not reference:
+                continue
+            if metric.endswith(HIGHER_IS_BETTER) and value < reference * (1 - tolerance):
+                regressions.append(f"{run}: {metric} {value:.4g} < baseline {reference:.4g}")
+            elif metric.endswith(LOWER_IS_BETTER) and value > reference * (1 + tolerance):
+                regressions.append(f"{run}: {metric} {value:.4g} > baseline {reference:.4g}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Quiz API benchmark suite")
+    parser.add_argument("runs", nargs="*", help="run or scenario names (default: all)")
+    parser.add_argument("--quick", action="store_true", help="use smaller sizes")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="fail on regression against this results file")
+    parser.add_argument("--save-baseline", nargs="?", const="bench-baseline.json",
+                        help="also write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown before failing (default 0.25)")
+    args = parser.parse_args(argv)
+
+    selected = [run for run in RUNS if not args.runs or run[0] in args.runs or run[1] in args.runs]
+    if not selected:
+        parser.error(f"unknown runs: {', '.join(args.runs)}")
+
+    results, failures = {}, []
+    for name, scenario, params, env in selected:
+        if args.quick:
+            params = dict(params, **QUICK_PARAMS.get(scenario, {}))
+        print(f"{name} ...", flush=True)
+        try:
+            results[name] = run_scenario(scenario, params, env)
+        except Exception as e:
+            failures.append(f"{name}: {e}")
+            continue
+        for metric, value in results[name].items():
+            print(f"    {metric:32} {value:12.4g}" if isinstance(value, float) else f"    {metric:32} {value:12}")
+
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("quick") != args.quick:
+            print("warning: baseline and results were not run with the same --quick setting")
+        failures += compare(results, baseline["results"], args.tolerance)
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Smallest valid-looking PNG header: the API only sniffs the signature
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def use_database(path):
+    """
+    Points the connection layer at another SQLite file for the default quiz,
+    the other quizzes next to it. Must run before the app is imported, since
+    the app migrates its database at import.
+    """
+    from services import db_service
+    from services.quiz_service import catalog
+
+    db_service.DB_PATH = path
+    db_service.reset_db_connections()
+    catalog.reset()
+    return path
+
+
+def use_temp_database():
+    """
+    :return: path of a fresh database file, now used by the connection layer
+    """
+    return use_database(os.path.join(tempfile.mkdtemp(prefix="quiz-bench-"), "quiz-db.db"))
+
+
+def seed_database(questions=50, answers=4, participations=1000, image_bytes=0, seed=42):
+    """
+    Replaces the quiz with synthetic questions, answers and participations.
+    :return: list of the correct answer index (1-based) of each position
+    """
+    from models.question_model import image_hash
+    from services.db_service import get_db_connection, release_db_connection
+    from services.image_service import write_image_file
+    from services.migration_service import run_migrations
+    from services.participation_writer import flush_participations
+    from services.question_service import invalidate_quiz_cache, bump_participations_version
+    from services.participation_writer import reset_participation_ids
+    from services.rank_service import get_score_ranking
+    from services.stats_service import delete_stats, rebuild_stats
+
+    run_migrations()
+    flush_participations()
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).isoformat()
+
+    question_rows, answer_rows, image_rows, correct = [], [], [], []
+    for position in range(1, questions + 1):
+        image = PNG_SIGNATURE + rng.randbytes(image_bytes) if image_bytes else b''
+        question_rows.append((position, f"Question {position}", f"Text of question {position}?",
+                              image_hash(image), now))
+        if image:
+            # Not a decodable image: stored as is, as the full variant only
+            image_rows.append((image_hash(image), "image/png", len(image), write_image_file(image), now))
+        correct_index = rng.randrange(answers)
+        correct.append(correct_index + 1)
+        for index in range(answers):
+            answer_rows.append((position, f"Answer {index + 1}", int(index == correct_index),
+                                rng.uniform(-60, 60), rng.uniform(-180, 180)))
+
+    participation_rows = [
+        (f"player{rng.randrange(participations or 1)}", rng.randint(0, questions), now)
+        for _ in range(participations)
+    ]
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("DELETE FROM answers")
+        cur.execute("DELETE FROM questions")
+        cur.execute("DELETE FROM images")
+        delete_stats(cur)
+        cur.execute("DELETE FROM participations")
+        cur.execute("DELETE FROM sqlite_sequence")
+        cur.executemany("""
+            INSERT INTO questions (id, position, title, text, image_hash, image_updated_at)
+            VALUES (?1, ?1, ?2, ?3, ?4, ?5)
+        """, question_rows)
+        cur.executemany("""
+            INSERT OR IGNORE INTO images (hash, variant, mime_type, size, file, created_at)
+            VALUES (?, 'full', ?, ?, ?, ?)
+        """, image_rows)
+        cur.executemany("""
+            INSERT INTO answers (question_id, text, is_correct, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?)
+        """, answer_rows)
+        cur.executemany("""
+            INSERT INTO participations (player_name, score, date) VALUES (?, ?, ?)
+        """, participation_rows)
+        cur.execute("COMMIT")
+    finally:
+        release_db_connection(conn)
+
+    reset_participation_ids()
+    # Seeded participations have no answers: their scores and dates are counted
+    rebuild_stats()
+    invalidate_quiz_cache()
+    get_score_ranking().reset()
+    bump_participations_version()
+    return correct
+
+
+def percentiles(samples):
+    """
+    :return: count, mean and p50/p90/p99/max of latency samples in seconds,
+    in milliseconds
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def best_of(repeat, function):
+    """
+    :return: fastest of `repeat` timings of function(), in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """
+    The API served by a real server in a child process (so that the load
+    generator does not share its interpreter), on a seeded database file.
+    """
+
+    def __init__(self, db_path, mode="wsgi", env=None):
+        self.db_path = db_path
+        self.mode = mode
+        self.env = env or {}
+        self.port = _free_port()
+        self._process = None
+
+    def __enter__(self):
+        env = dict(os.environ, **self.env)
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "bench.server", self.mode, self.db_path, str(self.port)],
+            cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"{self.mode} server exited with code {self._process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.mode} server did not start")
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+
+
+def http_load(port, flow, concurrency=8, duration=5.0):
+    """
+    Runs `flow` in `concurrency` threads for `duration` seconds, each with
+    its own keep-alive connection. A flow is a callable(client, rng) making
+    requests through client.request(method, path, body=None, headers=None).
+    :return: requests per second, bytes received and latency percentiles
+    """
+    samples, errors, received = [], [0], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(number):
+        client = HttpClient(port)
+        rng = random.Random(number)
+        while time.perf_counter() < stop_at:
+            flow(client, rng)
+        with lock:
+            samples.extend(client.samples)
+            errors[0] += client.errors
+            received[0] += client.received
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return dict(
+        percentiles(samples),
+        requests_per_s=len(samples) / elapsed,
+        bytes_per_request=received[0] / len(samples) if samples else 0,
+        errors=errors[0],
+    )
+
+
+class HttpClient:
+    def __init__(self, port):
+        self.port = port
+        self.samples = []
+        self.errors = 0
+        self.received = 0
+        self._connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        :return: (status, headers, body)
+        """
+        start = time.perf_counter()
+        try:
+            self._connection.request(method, path, body=body, headers=headers or {})
+            response = self._connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.errors += 1
+            self._connection.close()
+            self._connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            return 0, {}, b''
+
+        self.samples.append(time.perf_counter() - start)
+        self.received += len(data)
+        if response.status >= 500:
+            self.errors += 1
+        return response.status, response.headers, data
+
+    def close(self):
+        self._connection.close()
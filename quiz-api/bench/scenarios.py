@@ -0,0 +1,992 @@
+"""
+Benchmark scenarios. Each one runs in its own process, on its own seeded
+database, and returns a flat dict of metrics:
+
+    python -m bench.scenarios <name> '<json params>'
+
+Metric names carry their unit: *_per_s are higher-is-better, *_ms, *_us and
+*_kb lower-is-better, anything else is informational.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from bench.harness import (HttpClient, ServerProcess, best_of, http_load, percentiles, seed_database,
+                           use_temp_database)
+
+ADMIN_PASSWORD = os.environ.get("QUIZ_BENCH_PASSWORD", "iloveflask")
+
+SCENARIOS = {}
+
+
+def scenario(f):
+    SCENARIOS[f.__name__] = f
+    return f
+
+
+def _app():
+    from app import app
+    return app
+
+
+def _admin_headers(client):
+    response = client.post('/login', json={"password": ADMIN_PASSWORD})
+    return {"Authorization": f"Bearer {response.get_json()['token']}"}
+
+
+def _answers(correct, rng):
+    # Roughly half right, half wrong
+    return [index if rng.random() < 0.5 else index % 4 + 1 for index in correct]
+
+
+@scenario
+def player_flow(questions=20, participations=10000, flows=200):
+    """quiz-info, every question by position, then submit: test client."""
+    correct = seed_database(questions=questions, participations=participations)
+    client = _app().test_client()
+    rng = random.Random(1)
+    steps = {"quiz_info": [], "question": [], "submit": []}
+
+    def timed(step, call):
+        start = time.perf_counter()
+        response = call()
+        steps[step].append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+
+    start = time.perf_counter()
+    for flow in range(flows):
+        timed("quiz_info", lambda: client.get('/quiz-info?limit=10'))
+        for position in range(1, questions + 1):
+            timed("question", lambda: client.get(f'/questions?position={position}'))
+        body = {"playerName": f"bench{flow}", "answers": _answers(correct, rng)}
+        timed("submit", lambda: client.post('/participations', json=body))
+    elapsed = time.perf_counter() - start
+
+    metrics = {"flows_per_s": flows / elapsed}
+    for step, samples in steps.items():
+        for name, value in percentiles(samples).items():
+            if name in ("p50_ms", "p99_ms"):
+                metrics[f"{step}_{name}"] = value
+    return metrics
+
+
+@scenario
+def session_flow(questions=100, flows=100):
+    """Per-question session answers then finalize, against one bulk submit."""
+    correct = seed_database(questions=questions, participations=10000)
+    client = _app().test_client()
+    rng = random.Random(1)
+    answer, finalize, submit = [], [], []
+
+    for flow in range(flows):
+        answers = _answers(correct, rng)
+        session_id = client.post('/sessions', json={"playerName": f"bench{flow}"}).get_json()["sessionId"]
+        for position, index in enumerate(answers, start=1):
+            start = time.perf_counter()
+            client.post(f'/sessions/{session_id}/answers', json={"position": position, "answer": index})
+            answer.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = client.post(f'/sessions/{session_id}/finalize')
+        finalize.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_data()
+
+        start = time.perf_counter()
+        client.post('/participations', json={"playerName": f"bench{flow}", "answers": answers})
+        submit.append(time.perf_counter() - start)
+
+    return {
+        "answer_p50_ms": percentiles(answer)["p50_ms"],
+        "finalize_p50_ms": percentiles(finalize)["p50_ms"],
+        "bulk_submit_p50_ms": percentiles(submit)["p50_ms"],
+    }
+
+
+@scenario
+def bundle(questions=50, image_bytes=2000, rounds=30, window=5, rtt_ms=100):
+    """
+    Time to load every question: one request per question, bundle windows,
+    or the whole bundle, real server. Also modeled with a mobile round trip
+    time added per request, since requests are sequential.
+    """
+    db_path = use_temp_database()
+    seed_database(questions=questions, participations=0, image_bytes=image_bytes)
+    gzip_headers = {"Accept-Encoding": "gzip"}
+
+    def per_question(client):
+        for position in range(1, questions + 1):
+            client.request("GET", f"/questions?position={position}")
+        return questions
+
+    def windows(client):
+        for start in range(1, questions + 1, window):
+            client.request("GET", f"/quiz/bundle?from={start}&count={window}", headers=gzip_headers)
+        return -(-questions // window)
+
+    def whole(client):
+        client.request("GET", "/quiz/bundle", headers=gzip_headers)
+        return 1
+
+    metrics = {}
+    with ServerProcess(db_path) as server:
+        for name, load in (("per_question", per_question), ("windows", windows), ("bundle", whole)):
+            client = HttpClient(server.port)
+            load(client)
+            client.samples, client.received = [], 0
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                requests = load(client)
+                timings.append(time.perf_counter() - start)
+            client.close()
+            total_ms = percentiles(timings)["p50_ms"]
+            metrics[f"{name}_total_ms"] = total_ms
+            metrics[f"{name}_rtt{rtt_ms}_total_ms"] = total_ms + requests * rtt_ms
+            metrics[f"{name}_body_kb"] = client.received / rounds / 1024
+            metrics[f"{name}_errors"] = client.errors
+    return metrics
+
+
+def _player_http_flow(questions, correct):
+    counter = iter(range(10 ** 9))
+
+    def flow(client, rng):
+        client.request("GET", "/quiz-info?limit=10")
+        for position in range(1, questions + 1):
+            client.request("GET", f"/questions?position={position}")
+        body = json.dumps({"playerName": f"bench{next(counter)}", "answers": _answers(correct, rng)})
+        client.request("POST", "/participations", body=body, headers={"Content-Type": "application/json"})
+    return flow
+
+
+@scenario
+def player_flow_http(mode="wsgi", questions=20, participations=10000, concurrency=8, duration=5.0):
+    """The player flow against a real server (werkzeug or uvicorn)."""
+    db_path = use_temp_database()
+    correct = seed_database(questions=questions, participations=participations)
+    with ServerProcess(db_path, mode) as server:
+        result = http_load(server.port, _player_http_flow(questions, correct), concurrency, duration)
+    return {key: result[key] for key in ("requests_per_s", "p50_ms", "p90_ms", "p99_ms", "errors")}
+
+
+@scenario
+def admin_flow(questions=500, rounds=50):
+    """Insert at the top, update, move, reorder and delete: test client."""
+    seed_database(questions=questions, participations=0)
+    client = _app().test_client()
+    headers = _admin_headers(client)
+    steps = {"create": [], "update": [], "reorder": [], "delete": []}
+    question = {"title": "Bench", "position": 1, "text": "New question?", "image": "",
+                "possibleAnswers": [{"text": "A", "isCorrect": True}, {"text": "B", "isCorrect": False}]}
+
+    def timed(step, call, status):
+        start = time.perf_counter()
+        response = call()
+        steps[step].append(time.perf_counter() - start)
+        assert response.status_code == status, (step, response.status_code)
+        return response
+
+    for _ in range(rounds):
+        created = timed("create", lambda: client.post('/questions', json=question, headers=headers), 200)
+        question_id = created.get_json()["id"]
+        moved = dict(question, position=questions // 2)
+        timed("update", lambda: client.put(f'/questions/{question_id}', json=moved, headers=headers), 204)
+        ids = [entry["id"] for entry in client.get('/questions').get_json()]
+        ids.reverse()
+        timed("reorder", lambda: client.put('/questions/order', json=ids, headers=headers), 204)
+        timed("delete", lambda: client.delete(f'/questions/{question_id}', headers=headers), 204)
+
+    return {f"{step}_p50_ms": percentiles(samples)["p50_ms"] for step, samples in steps.items()}
+
+
+@scenario
+def auth(requests=2000):
+    """Token verification with and without the memo, and login cost."""
+    from jwt_utils import build_token, decode_token, verify_token
+
+    client = _app().test_client()
+    start = time.perf_counter()
+    headers = _admin_headers(client)
+    login = time.perf_counter() - start
+
+    token = build_token()
+    verify_token(token)
+    uncached = best_of(3, lambda: [decode_token(token) for _ in range(requests)])
+    cached = best_of(3, lambda: [verify_token(token) for _ in range(requests)])
+
+    samples = []
+    for _ in range(requests // 4):
+        start = time.perf_counter()
+        response = client.get('/cache-stats', headers=headers)
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+
+    return {
+        "login_ms": login * 1000,
+        "verify_uncached_us": uncached / requests * 1e6,
+        "verify_cached_us": cached / requests * 1e6,
+        "admin_request_p50_ms": percentiles(samples)["p50_ms"],
+    }
+
+
+def _legacy_score(cur, submitted_answers):
+    # Scoring before the bulk engine: one query per submitted answer
+    score = 0
+    for position, answer_index in enumerate(submitted_answers, start=1):
+        cur.execute("""
+            SELECT a.is_correct FROM answers a
+            JOIN questions q ON q.id = a.question_id
+            WHERE q.position = ?
+            ORDER BY a.id LIMIT 1 OFFSET ?
+        """, (position, answer_index - 1))
+        row = cur.fetchone()
+        if row is None:
+            raise ValueError(f"Invalid answer index for question at position {position}")
+        score += row[0]
+    return score
+
+
+@scenario
+def scoring(sizes=(10, 100, 1000), submissions=200):
+    """Per-answer queries against the in-memory answer key."""
+    from services.db_service import get_db_connection, release_db_connection
+    from services.question_service import get_quiz_snapshot, score_answers
+
+    metrics = {}
+    rng = random.Random(1)
+    for size in sizes:
+        correct = seed_database(questions=size, participations=0)
+        answer_sets = [_answers(correct, rng) for _ in range(submissions)]
+        snapshot = get_quiz_snapshot()
+
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            legacy = best_of(3, lambda: [_legacy_score(cur, answers) for answers in answer_sets])
+        finally:
+            release_db_connection(conn)
+        current = best_of(3, lambda: [score_answers(snapshot.answer_key, answers) for answers in answer_sets])
+
+        metrics[f"legacy_{size}q_per_s"] = submissions / legacy
+        metrics[f"answer_key_{size}q_per_s"] = submissions / current
+    return metrics
+
+
+# (name, method, url, statements cold, statements warm): cold is the first
+# request after the quiz cache was dropped, and must not grow with the quiz
+QUERY_BUDGETS = [
+    ("by_position", "get", "/questions?position=3", 5, 0),
+    ("questions", "get", "/questions", 5, 0),
+    ("quiz_info", "get", "/quiz-info", 6, 1),
+    ("submit", "post", "/participations", 12, 1),
+]
+
+
+@scenario
+def queries(sizes=(10, 200)):
+    """SQLite statements per request; fails when one goes over its budget."""
+    import re
+    from services.question_service import invalidate_quiz_cache
+
+    if os.environ.get("QUIZ_SERVER_TIMING") != "1":
+        raise RuntimeError("run with QUIZ_SERVER_TIMING=1: the statements are read from Server-Timing")
+    client = _app().test_client()
+
+    def count(method, url, body):
+        response = getattr(client, method)(url, json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"{method.upper()} {url}: {response.status_code}")
+        return int(re.search(r'desc="(\d+) queries"', response.headers["Server-Timing"]).group(1))
+
+    metrics, over = {}, []
+    for size in sizes:
+        correct = seed_database(questions=size, participations=100)
+        for name, method, url, cold_budget, warm_budget in QUERY_BUDGETS:
+            body = {"playerName": "bench", "answers": correct} if method == "post" else None
+            invalidate_quiz_cache()
+            cold = count(method, url, body)
+            warm = count(method, url, body)
+            metrics[f"{name}_{size}q_cold_queries"] = cold
+            metrics[f"{name}_{size}q_warm_queries"] = warm
+            if cold > cold_budget or warm > warm_budget:
+                over.append(f"{name} with {size} questions: {cold} cold / {warm} warm, "
+                            f"budget {cold_budget} / {warm_budget}")
+    if over:
+        raise AssertionError("over the query budget: " + "; ".join(over))
+    return metrics
+
+
+# (name, statement as the services run it, parameters, expected plan, index):
+# every step of the plan must be `expected ... USING [COVERING] INDEX index`
+QUERY_PLANS = [
+    ("question_by_position", "SELECT id FROM questions WHERE position = ?", (3,),
+     "SEARCH", "idx_questions_position"),
+    ("answers_by_question", "SELECT question_id, text, is_correct FROM answers WHERE question_id = ?", (3,),
+     "SEARCH", "idx_answers_question_id"),
+    ("delete_answers", "DELETE FROM answers WHERE question_id = ?", (3,),
+     "SEARCH", "idx_answers_question_id"),
+    ("leaderboard_after", """
+        SELECT id, player_name, score, date FROM participations WHERE (score, id) < (?, ?)
+        ORDER BY score DESC, id DESC LIMIT ? OFFSET ?
+    """, (5, 10, 20, 0), "SEARCH", "idx_participations_score"),
+    # The first page walks the index in order and stops at the limit
+    ("leaderboard_first_page", """
+        SELECT id, player_name, score, date FROM participations
+        ORDER BY score DESC, id DESC LIMIT ? OFFSET ?
+    """, (20, 0), "SCAN", "idx_participations_score"),
+    ("player_best_score", "SELECT MAX(score) AS score FROM participations WHERE player_name = ?", ("player1",),
+     "SEARCH", "idx_participations_player_name"),
+]
+
+
+@scenario
+def query_plans(questions=50, participations=10000):
+    """EXPLAIN QUERY PLAN of the hot statements; fails when one stops using its index."""
+    from services.db_service import get_db_connection, release_db_connection
+
+    seed_database(questions=questions, participations=participations)
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        wrong = []
+        for name, sql, params, expected, index in QUERY_PLANS:
+            steps = [row[3] for row in cur.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            if not all(step.startswith(expected) and f"INDEX {index}" in step for step in steps):
+                wrong.append(f"{name}: {' / '.join(steps)}")
+    finally:
+        release_db_connection(conn)
+
+    if wrong:
+        raise AssertionError("query plans not using their index: " + "; ".join(wrong))
+    return {"plans_checked": len(QUERY_PLANS)}
+
+
+@scenario
+def geo_scoring(submissions=2000, clicks=5, locations=(1, 100)):
+    """Map-click scoring one submission at a time vs a batch, with and without numpy."""
+    from services import geo_service
+    from services.question_service import answer_points, get_quiz_snapshot, invalidate_quiz_cache, score_submissions
+    from services.db_service import get_db_connection, release_db_connection
+
+    metrics = {}
+    rng = random.Random(1)
+    for count in locations:
+        seed_database(questions=clicks, participations=0)
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            # Every answer gets a location; `count` correct ones per question
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute("UPDATE answers SET latitude = 0, longitude = 0")
+            cur.executemany("""
+                INSERT INTO answers (question_id, text, is_correct, latitude, longitude)
+                VALUES (?, 'place', 1, ?, ?)
+            """, [(position, rng.uniform(-60, 60), rng.uniform(-180, 180))
+                  for position in range(1, clicks + 1) for _ in range(count)])
+            cur.execute("COMMIT")
+        finally:
+            release_db_connection(conn)
+        invalidate_quiz_cache()
+        snapshot = get_quiz_snapshot()
+        answer_sets = [[{"latitude": rng.uniform(-60, 60), "longitude": rng.uniform(-180, 180)}
+                        for _ in range(clicks)] for _ in range(submissions)]
+
+        numpy = geo_service.np
+        for label, np_module in (("", numpy), ("_python", None)):
+            if label and numpy is None:
+                continue
+            geo_service.np = np_module
+            try:
+                single = best_of(3, lambda: [answer_points(snapshot.answer_key, answers, snapshot.geo_key)
+                                             for answers in answer_sets])
+                batch = best_of(3, lambda: score_submissions(snapshot.answer_key, answer_sets, snapshot.geo_key))
+            finally:
+                geo_service.np = numpy
+            metrics[f"single_{count}loc{label}_per_s"] = submissions / single
+            metrics[f"batch_{count}loc{label}_per_s"] = submissions / batch
+    return metrics
+
+
+@scenario
+def concurrent_reads(readers=4, duration=2.0, questions=200):
+    """Reader throughput alone, then while a writer keeps updating."""
+    from services.db_service import get_db_connection, release_db_connection
+
+    seed_database(questions=questions, participations=1000)
+
+    def run(with_writer):
+        stop = threading.Event()
+        counts = [0] * readers
+
+        def reader(number):
+            while not stop.is_set():
+                conn = get_db_connection()
+                try:
+                    conn.cursor().execute("SELECT id, title, text FROM questions ORDER BY position").fetchall()
+                finally:
+                    release_db_connection(conn)
+                counts[number] += 1
+
+        def writer():
+            while not stop.is_set():
+                conn = get_db_connection()
+                try:
+                    cur = conn.cursor()
+                    cur.execute("BEGIN IMMEDIATE")
+                    cur.execute("UPDATE questions SET text = text WHERE position = 1")
+                    time.sleep(0.001)
+                    cur.execute("COMMIT")
+                finally:
+                    release_db_connection(conn)
+
+        threads = [threading.Thread(target=reader, args=(number,)) for number in range(readers)]
+        if with_writer:
+            threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return sum(counts) / duration
+
+    return {"reads_per_s": run(False), "reads_with_writer_per_s": run(True)}
+
+
+@scenario
+def reorder(sizes=(1000, 10000)):
+    """Position shifts and whole-bank reorders on large banks."""
+    from services.question_service import (create_question, delete_question_by_id, reorder_questions,
+                                           update_question_by_id, get_all_questions)
+
+    question = {"title": "Bench", "position": 1, "text": "Moved?", "image": "",
+                "possibleAnswers": [{"text": "A", "isCorrect": True}]}
+    metrics = {}
+    for size in sizes:
+        seed_database(questions=size, participations=0)
+
+        start = time.perf_counter()
+        question_id = create_question(question)
+        metrics[f"insert_first_{size}_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        update_question_by_id(question_id, dict(question, position=size + 1))
+        metrics[f"move_to_last_{size}_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        delete_question_by_id(question_id)
+        metrics[f"delete_{size}_ms"] = (time.perf_counter() - start) * 1000
+
+        ids = [entry.id for entry in get_all_questions()]
+        ids.reverse()
+        start = time.perf_counter()
+        reorder_questions(ids)
+        metrics[f"reorder_all_{size}_ms"] = (time.perf_counter() - start) * 1000
+    return metrics
+
+
+@scenario
+def rank(sizes=(1000, 100000, 10000000), max_score=100, lookups=20000):
+    """Rank lookups and inserts over synthetic score distributions."""
+    from services.rank_service import ScoreRanking
+
+    metrics = {}
+    rng = random.Random(1)
+    for size in sizes:
+        # Binomial-ish distribution of `size` participations
+        weights = [rng.random() for _ in range(max_score + 1)]
+        total_weight = sum(weights)
+        counts = {score: int(size * weight / total_weight) for score, weight in enumerate(weights)}
+        ranking = ScoreRanking(lambda: (size, dict(counts)))
+        scores = [rng.randint(0, max_score) for _ in range(lookups)]
+
+        ranking.total()
+        lookup = best_of(3, lambda: [ranking.rank(score) for score in scores])
+        next_ids = iter(range(size + 1, size + 10 ** 7))
+        add = best_of(3, lambda: [ranking.add(score, next(next_ids)) for score in scores])
+        metrics[f"rank_{size}_us"] = lookup / lookups * 1e6
+        metrics[f"add_{size}_us"] = add / lookups * 1e6
+    return metrics
+
+
+@scenario
+def conditional_get(questions=50, concurrency=8, duration=3.0):
+    """GET /questions with and without If-None-Match, real server."""
+    db_path = use_temp_database()
+    seed_database(questions=questions, participations=0)
+    metrics = {}
+    with ServerProcess(db_path) as server:
+        def plain(client, rng):
+            client.request("GET", "/questions")
+
+        probe = HttpClient(server.port)
+        etag = probe.request("GET", "/questions")[1]["ETag"]
+        probe.close()
+
+        def conditional(client, rng):
+            client.request("GET", "/questions", headers={"If-None-Match": etag})
+
+        for name, flow in (("full", plain), ("conditional", conditional)):
+            result = http_load(server.port, flow, concurrency, duration)
+            metrics[f"{name}_per_s"] = result["requests_per_s"]
+            metrics[f"{name}_p99_ms"] = result["p99_ms"]
+            metrics[f"{name}_body_kb"] = result["bytes_per_request"] / 1024
+            metrics[f"{name}_errors"] = result["errors"]
+    return metrics
+
+
+@scenario
+def serving_modes(questions=20, concurrency=32, duration=5.0):
+    """Question reads under WSGI (threaded werkzeug) and ASGI (uvicorn)."""
+    db_path = use_temp_database()
+    seed_database(questions=questions, participations=1000)
+    metrics = {}
+
+    def flow(client, rng):
+        client.request("GET", f"/questions?position={rng.randint(1, questions)}")
+
+    for mode in ("wsgi", "asgi"):
+        try:
+            with ServerProcess(db_path, mode) as server:
+                result = http_load(server.port, flow, concurrency, duration)
+        except RuntimeError:
+            # uvicorn/a2wsgi not installed
+            continue
+        for key in ("requests_per_s", "p50_ms", "p99_ms", "errors"):
+            metrics[f"{mode}_{key}"] = result[key]
+    return metrics
+
+
+@scenario
+def submissions(questions=20, threads=8, per_thread=300):
+    """Concurrent POST /participations; run with QUIZ_WRITE_BEHIND on and off."""
+    from services.participation_writer import flush_participations, get_participation_writer
+    from services.db_service import get_db_connection, release_db_connection
+    from services.question_service import create_participation_handler
+
+    correct = seed_database(questions=questions, participations=0)
+    rng = random.Random(1)
+    answer_sets = [_answers(correct, rng) for _ in range(per_thread)]
+
+    def submit(number):
+        for answers in answer_sets:
+            create_participation_handler(f"bench{number}", answers)
+
+    workers = [threading.Thread(target=submit, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    flush_participations()
+    elapsed = time.perf_counter() - start
+    metrics = {"submissions_per_s": threads * per_thread / elapsed}
+
+    participation_writer = get_participation_writer()
+    if participation_writer is not None:
+        # Time until a lone submission is visible to other connections
+        result = create_participation_handler("idle", answer_sets[0])
+        start = time.perf_counter()
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            while cur.execute("SELECT 1 FROM participations WHERE id = ?", (result["id"],)).fetchone() is None:
+                time.sleep(0.001)
+        finally:
+            release_db_connection(conn)
+        metrics["idle_flush_ms"] = (time.perf_counter() - start) * 1000
+        metrics["batches"] = participation_writer.batches
+    return metrics
+
+
+@scenario
+def bulk_roundtrip(questions=10000, image_bytes=0):
+    """NDJSON import then export of a large bank, test client."""
+    seed_database(questions=1, participations=0)
+    client = _app().test_client()
+    headers = _admin_headers(client)
+    lines = []
+    for position in range(1, questions + 1):
+        lines.append(json.dumps({
+            "title": "Bulk", "text": f"Question {position}?", "image": "",
+            "possibleAnswers": [{"text": f"Answer {index}", "isCorrect": index == 1} for index in range(1, 5)]
+        }))
+    body = ("\n".join(lines) + "\n").encode()
+
+    start = time.perf_counter()
+    response = client.post('/questions/bulk?mode=replace', data=body, headers=headers)
+    imported = time.perf_counter() - start
+    assert response.status_code == 200, response.get_data()
+
+    start = time.perf_counter()
+    exported = sum(1 for line in client.get('/questions/export', headers=headers).response if line.strip())
+    elapsed = time.perf_counter() - start
+    assert exported >= questions, exported
+    return {"import_ms": imported * 1000, "export_ms": elapsed * 1000, "import_per_s": questions / imported}
+
+
+@scenario
+def image_ingest(images=6, side=2000):
+    """Question creation with a photo-sized PNG upload: encoding, then dedup."""
+    import base64
+    import io
+    from PIL import Image
+    from services.db_service import get_db_connection, release_db_connection
+
+    seed_database(questions=1, participations=0)
+    client = _app().test_client()
+    headers = _admin_headers(client)
+
+    uploads = []
+    for index in range(images):
+        # Gradient plus noise: compresses about like a photo
+        gradient = Image.linear_gradient("L").resize((side, side)).rotate(index * 30)
+        noise = Image.effect_noise((side, side), 24 + index)
+        image = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+        output = io.BytesIO()
+        image.save(output, "PNG")
+        uploads.append(output.getvalue())
+
+    def create(data):
+        start = time.perf_counter()
+        response = client.post('/questions', headers=headers, json={
+            "title": "Image", "position": 1, "text": "Where?",
+            "image": f"data:image/png;base64,{base64.b64encode(data).decode('ascii')}",
+            "possibleAnswers": [{"text": "Here", "isCorrect": True}]
+        })
+        assert response.status_code == 200, response.get_data()
+        return time.perf_counter() - start
+
+    created = [create(data) for data in uploads]
+    duplicates = [create(data) for data in uploads]
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        stored = dict(cur.execute("SELECT variant, SUM(size) FROM images GROUP BY variant").fetchall())
+    finally:
+        release_db_connection(conn)
+    return {
+        "create_p50_ms": percentiles(created)["p50_ms"],
+        "create_duplicate_p50_ms": percentiles(duplicates)["p50_ms"],
+        "upload_kb": sum(map(len, uploads)) / images / 1024,
+        "stored_kb": sum(stored.values()) / images / 1024,
+        "thumb_kb": stored.get("thumb", 0) / images / 1024,
+        "mobile_kb": stored.get("mobile", 0) / images / 1024,
+    }
+
+
+@scenario
+def image_storage(questions=200, image_bytes=100_000, requests=50):
+    """Database size and per-request memory of images: BLOBs vs the file store."""
+    import io
+    import sqlite3
+    from flask import send_file
+    from bench.harness import PNG_SIGNATURE
+    from models.question_model import image_hash
+    from services import db_service, migration_service
+    from services.db_service import get_db_connection, release_db_connection
+
+    # Schema version 5, with images as BLOBs in the database
+    migrations = migration_service.MIGRATIONS
+    migration_service.MIGRATIONS = [migration for migration in migrations if migration[0] <= 5]
+    migration_service.run_migrations()
+    migration_service.MIGRATIONS = migrations
+
+    # The same BLOBs in a side database, to serve them as before the migration
+    blobs = sqlite3.connect(os.path.join(os.path.dirname(db_service.DB_PATH), "blobs.db"), check_same_thread=False)
+    blobs.execute("CREATE TABLE blobs (question_id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+
+    rng = random.Random(1)
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        for position in range(1, questions + 1):
+            image = PNG_SIGNATURE + rng.randbytes(image_bytes)
+            cur.execute("INSERT INTO questions (title, position, text, image, image_hash) VALUES ('Q', ?, 'T', X'', ?)",
+                        (position, image_hash(image)))
+            cur.execute("""
+                INSERT INTO images (hash, variant, mime_type, data, created_at) VALUES (?, 'full', 'image/png', ?, '')
+            """, (image_hash(image), image))
+            blobs.execute("INSERT INTO blobs VALUES (?, ?)", (cur.lastrowid, image))
+        cur.execute("COMMIT")
+        cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        cur.fetchall()
+        blobs.commit()
+    finally:
+        release_db_connection(conn)
+    db_before = os.path.getsize(db_service.DB_PATH)
+
+    start = time.perf_counter()
+    migration_service.run_migrations()
+    migrated = time.perf_counter() - start
+    db_after = os.path.getsize(db_service.DB_PATH)
+
+    app = _app()
+    from services.question_service import get_question_image
+
+    def serve_blob(question_id):
+        data = blobs.execute("SELECT data FROM blobs WHERE question_id = ?", (question_id,)).fetchone()[0]
+        return send_file(io.BytesIO(data), mimetype="image/png")
+
+    def serve_file(question_id):
+        return send_file(get_question_image(question_id)[0], mimetype="image/png")
+
+    def request_peak(serve):
+        # Largest allocation peak of one request, body streamed as a server would
+        served, peak = 0, 0
+        tracemalloc.start()
+        for question_id in range(1, requests + 1):
+            tracemalloc.reset_peak()
+            with app.test_request_context(f'/questions/{question_id}/image'):
+                response = serve(question_id)
+                response.direct_passthrough = False
+                served += sum(len(chunk) for chunk in response.response)
+                response.close()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        return served, peak
+
+    blob_served, blob_peak = request_peak(serve_blob)
+    file_served, file_peak = request_peak(serve_file)
+    assert file_served == blob_served, (file_served, blob_served)
+
+    return {
+        "db_blobs_kb": db_before / 1024,
+        "db_kb": db_after / 1024,
+        "migrate_ms": migrated * 1000,
+        "request_peak_blob_kb": blob_peak / 1024,
+        "request_peak_kb": file_peak / 1024,
+    }
+
+
+@scenario
+def compression(sizes=(20, 200), requests=200):
+    """CPU time per request and body size by encoding, cached vs per-request compression."""
+    from services.compression_service import DYNAMIC_LEVELS, ENCODINGS, compress
+
+    client = _app().test_client()
+    metrics = {}
+    for size in sizes:
+        seed_database(questions=size, participations=size * 20)
+        for endpoint, url in (("questions", "/questions"), ("bundle", "/quiz/bundle"),
+                              ("quiz_info", "/quiz-info?limit=100")):
+            identity = client.get(url).get_data()
+            for encoding in ("identity",) + ENCODINGS:
+                headers = {"Accept-Encoding": encoding}
+                response = client.get(url, headers=headers)
+                assert response.status_code == 200, response.status_code
+
+                start = time.process_time()
+                for _ in range(requests):
+                    client.get(url, headers=headers)
+                cpu = (time.process_time() - start) / requests
+                prefix = f"q{size}_{endpoint}_{encoding}"
+                metrics[f"{prefix}_kb"] = len(response.get_data()) / 1024
+                metrics[f"{prefix}_cpu_us"] = cpu * 1e6
+                if encoding != "identity":
+                    # What compressing each response would add, without the cache
+                    metrics[f"{prefix}_compress_us"] = best_of(5, lambda: compress(identity, encoding, DYNAMIC_LEVELS)) * 1e6
+    return metrics
+
+
+@scenario
+def serialization(questions=10000):
+    """Snapshot memory and GET /questions payload build time."""
+    from services.question_service import get_all_questions_json, get_quiz_snapshot, invalidate_quiz_cache
+
+    seed_database(questions=questions, participations=0)
+    get_quiz_snapshot()
+    invalidate_quiz_cache()
+
+    tracemalloc.start()
+    get_quiz_snapshot()
+    snapshot_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def rebuild():
+        invalidate_quiz_cache()
+        get_quiz_snapshot()
+
+    load = best_of(3, rebuild)
+
+    # First GET /questions of a version: serialization of every question
+    builds = []
+    for _ in range(3):
+        rebuild()
+        builds.append(best_of(1, get_all_questions_json))
+    payload = min(builds)
+    cached = best_of(3, lambda: [get_all_questions_json() for _ in range(1000)]) / 1000
+    return {
+        "snapshot_kb": snapshot_bytes / 1024,
+        "snapshot_load_ms": load * 1000,
+        "payload_build_ms": payload * 1000,
+        "payload_cached_us": cached * 1e6,
+    }
+
+
+
+@scenario
+def tenancy(questions=200, readers=2, duration=2.0, quizzes=100, max_open=16):
+    """Quiz opens, reads of one quiz while another one or itself is written, LRU churn."""
+    from services import db_service
+    from services.db_service import use_quiz
+    from services.question_service import (get_all_questions_json, get_question_by_position, get_quiz_info_handler,
+                                           record_participation, update_question_by_id)
+    from services.quiz_service import create_quiz
+
+    metrics = {}
+    for quiz_id in ("quiet", "busy"):
+        create_quiz(quiz_id, quiz_id)
+        with use_quiz(quiz_id):
+            seed_database(questions=questions, participations=1000)
+
+    # First request of a new quiz: file created and migrated
+    opens = []
+    for number in range(5):
+        create_quiz(f"cold{number}", "Cold")
+        start = time.perf_counter()
+        with use_quiz(f"cold{number}"):
+            pass
+        opens.append(time.perf_counter() - start)
+    metrics["cold_open_ms"] = min(opens) * 1000
+
+    def read_latencies(written_quiz):
+        stop = threading.Event()
+        samples = []
+
+        def reader():
+            while not stop.is_set():
+                start = time.perf_counter()
+                with use_quiz("quiet"):
+                    get_all_questions_json()
+                    get_quiz_info_handler(limit=20)
+                samples.append(time.perf_counter() - start)
+
+        def writer():
+            with use_quiz(written_quiz):
+                question = get_question_by_position(1)
+                edit = {"title": question.title, "position": 1, "text": question.text, "image": "",
+                        "possibleAnswers": [{"text": "A", "isCorrect": True}, {"text": "B", "isCorrect": False}]}
+                while not stop.is_set():
+                    update_question_by_id(question.id, edit)
+                    for _ in range(10):
+                        record_participation("writer", 1)
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)] + [threading.Thread(target=writer)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return percentiles(samples)
+
+    # Writes to another quiz leave this one's snapshot and file alone;
+    # writes to the same quiz rebuild its snapshot after each edit
+    isolated, shared = read_latencies("busy"), read_latencies("quiet")
+    metrics["read_other_written_p50_ms"] = isolated["p50_ms"]
+    metrics["read_other_written_p99_ms"] = isolated["p99_ms"]
+    metrics["read_same_written_p50_ms"] = shared["p50_ms"]
+    metrics["read_same_written_p99_ms"] = shared["p99_ms"]
+
+    # More quizzes than open handles: the idle ones are closed and reopened
+    db_service.databases.max_open = max_open
+    for number in range(quizzes):
+        create_quiz(f"churn{number}", "Churn")
+        with use_quiz(f"churn{number}"):
+            seed_database(questions=10, participations=0)
+    rng = random.Random(1)
+    requests = 2000
+    evicted = db_service.databases.evicted
+    start = time.perf_counter()
+    for _ in range(requests):
+        with use_quiz(f"churn{rng.randrange(quizzes)}"):
+            get_all_questions_json()
+    metrics["churn_requests_per_s"] = requests / (time.perf_counter() - start)
+    metrics["churn_evictions"] = db_service.databases.evicted - evicted
+    return metrics
+
+
+@scenario
+def stats(sizes=(10000, 100000, 1000000), questions=20, reads=200):
+    """Stats endpoints on growing histories, against scanning the history."""
+    from datetime import datetime, timedelta, timezone
+    from services import stats_service
+    from services.db_service import get_db_connection, release_db_connection
+    from services.question_service import get_all_questions, get_quiz_snapshot
+
+    app = _app()
+    client = app.test_client()
+    headers = _admin_headers(client)
+    metrics = {}
+    rng = random.Random(1)
+    for size in sizes:
+        seed_database(questions=questions, participations=0)
+        question_ids = get_quiz_snapshot().question_ids
+        layout_id, _ = stats_service.answer_columns(question_ids, ())
+        now = datetime.now(timezone.utc)
+
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            for first in range(1, size + 1, 50000):
+                ids = range(first, min(first + 50000, size + 1))
+                points = [bytes(rng.choices((0, 1), k=questions)) for _ in ids]
+                # Spread over the last 30 days, for the activity
+                cur.executemany("""
+                    INSERT INTO participations (id, player_name, score, date, layout_id, points)
+                    VALUES (?, 'bench', ?, ?, ?, ?)
+                """, [(participation_id, sum(blob), (now - timedelta(minutes=rng.randrange(43200))).isoformat(),
+                       layout_id, blob)
+                      for participation_id, blob in zip(ids, points)])
+            cur.execute("COMMIT")
+
+            def scan():
+                # What the stats cost without aggregates: every row, every answer
+                aggregates = stats_service.Aggregates()
+                for score, date, blob in cur.execute("SELECT score, date, points FROM participations"):
+                    aggregates.add(score, date, question_ids, stats_service.decode_points(blob, questions))
+                return aggregates
+
+            metrics[f"scan_{size}_ms"] = best_of(1, scan) * 1000
+        finally:
+            release_db_connection(conn)
+
+        metrics[f"rebuild_{size}_ms"] = best_of(1, stats_service.rebuild_stats) * 1000
+        numpy, stats_service.np = stats_service.np, None
+        try:
+            metrics[f"rebuild_{size}_python_ms"] = best_of(1, stats_service.rebuild_stats) * 1000
+        finally:
+            stats_service.np = numpy
+
+        quiz_stats = stats_service.get_quiz_stats()
+        start = time.perf_counter()
+        quiz_stats.scores()
+        metrics[f"load_{size}_ms"] = (time.perf_counter() - start) * 1000
+
+        questions_list = get_all_questions()
+        read = best_of(3, lambda: [(quiz_stats.scores(), quiz_stats.questions(questions_list), quiz_stats.activity())
+                                   for _ in range(reads)])
+        metrics[f"read_{size}_us"] = read / reads * 1e6
+        endpoint = best_of(3, lambda: [client.get(url, headers=headers)
+                                       for _ in range(reads // 3)
+                                       for url in ("/stats", "/stats/questions", "/stats/activity?bucket=day")])
+        metrics[f"endpoint_{size}_us"] = endpoint / (reads // 3 * 3) * 1e6
+    return metrics
+
+
+def main(name, params):
+    use_temp_database()
+    result = SCENARIOS[name](**params)
+    # Last line of stdout, read by the runner
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], json.loads(sys.argv[2]) if len(sys.argv) > 2 else {})
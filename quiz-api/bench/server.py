@@ -0,0 +1,27 @@
+"""
+Serves the API on an existing database for the HTTP benchmarks:
+
+    python -m bench.server wsgi|asgi <db path> <port>
+"""
+import os
+import sys
+from bench.harness import use_database
+
+
+def main(mode, db_path, port):
+    # Per-request access logs would dominate the measurements
+    os.environ.setdefault("QUIZ_LOG_LEVEL", "WARNING")
+    use_database(db_path)
+
+    if mode == "asgi":
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host="127.0.0.1", port=port, log_level="warning")
+    else:
+        from werkzeug.serving import make_server
+        from app import app
+        make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], sys.argv[2], int(sys.argv[3]))
@@ -1,5 +1,10 @@
 import jwt
 import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
 from werkzeug.exceptions import Unauthorized
 
 
@@ -12,8 +17,17 @@ class JwtError(Exception):
         super().__init__(self.message)
 
 
-secret = "Groupe 1 - ce quiz est un piège au cerveau!"
+secret = os.environ.get("QUIZ_JWT_SECRET", "Groupe 1 - ce quiz est un piège au cerveau!")
 expiration_in_seconds = 3600
+admin_subject = 'quiz-app-admin'
+
+# Encoded once instead of on every encode/decode
+_secret_key = secret.encode('utf-8')
+
+# Verified tokens: sha256(token) -> (exp, sub), at most TOKEN_CACHE_SIZE
+TOKEN_CACHE_SIZE = 1024
+_verified_tokens = OrderedDict()
+_verified_tokens_lock = threading.Lock()
 
 
 def build_token():
@@ -25,28 +39,65 @@ def build_token():
         payload = {
             'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=expiration_in_seconds),
             'iat': datetime.datetime.utcnow(),
-            'sub': 'quiz-app-admin'
+            'sub': admin_subject
         }
         return jwt.encode(
             payload,
-            secret,
+            _secret_key,
             algorithm="HS256"
         )
     except Exception as e:
         return e
 
 
+def _decode_payload(auth_token):
+    try:
+        payload = jwt.decode(auth_token, _secret_key, algorithms="HS256", options={"require": ["exp", "sub"]})
+    except jwt.ExpiredSignatureError:
+        raise JwtError('Signature expired. Please log in again.')
+    except jwt.InvalidTokenError as e:
+        raise JwtError('Invalid token. Please log in again.')
+    # Only tokens issued by build_token are accepted
+    if payload['sub'] != admin_subject:
+        raise JwtError('Invalid token. Please log in again.')
+    return payload
+
+
 def decode_token(auth_token):
     """
     Decodes the auth token
     :param auth_token:
     :return: integer|string
     """
-    try:
-        payload = jwt.decode(auth_token, secret, algorithms="HS256")
-        # if decoding did not fail, this means we are correctly logged in
-        return payload['sub']
-    except jwt.ExpiredSignatureError:
-        raise JwtError('Signature expired. Please log in again.')
-    except jwt.InvalidTokenError as e:
-        raise JwtError('Invalid token. Please log in again.')
+    # if decoding did not fail, this means we are correctly logged in
+    return _decode_payload(auth_token)['sub']
+
+
+def verify_token(auth_token):
+    """
+    Same as decode_token, but tokens already verified are remembered until
+    they expire: a repeated admin call costs a hash and a dict lookup
+    instead of a signature check.
+    :param auth_token:
+    :return: string
+    """
+    digest = hashlib.sha256(auth_token.encode('utf-8')).digest()
+    now = time.time()
+
+    with _verified_tokens_lock:
+        entry = _verified_tokens.get(digest)
+        if entry is not None:
+            if entry[0] > now:
+                _verified_tokens.move_to_end(digest)
+                return entry[1]
+            del _verified_tokens[digest]
+            raise JwtError('Signature expired. Please log in again.')
+
+    payload = _decode_payload(auth_token)
+    expires_at, subject = payload['exp'], payload['sub']
+
+    with _verified_tokens_lock:
+        _verified_tokens[digest] = (expires_at, subject)
+        if len(_verified_tokens) > TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    return subject
@@ -1,6 +1,25 @@
 class Answer:
+    __slots__ = ('text', 'is_correct', 'latitude', 'longitude')
+
     def __init__(self, text: str, is_correct: bool, latitude: float = None, longitude: float = None):
         self.text = text
         self.is_correct = is_correct
         self.latitude = latitude
-        self.longitude = longitude
\ No newline at end of file
+        self.longitude = longitude
+
+def answer_to_json(answer):
+    data = {"text": answer.text, "isCorrect": answer.is_correct}
+    if answer.latitude is not None:
+        data["latitude"] = answer.latitude
+    if answer.longitude is not None:
+        data["longitude"] = answer.longitude
+    return data
+
+def answer_to_player_json(answer):
+    # What a player may see: no correctness flag
+    data = {"text": answer.text}
+    if answer.latitude is not None:
+        data["latitude"] = answer.latitude
+    if answer.longitude is not None:
+        data["longitude"] = answer.longitude
+    return data
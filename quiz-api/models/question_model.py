@@ -1,33 +1,113 @@
 import base64
+import hashlib
+import logging
 import re
-from models.answer_model import Answer
+from models.answer_model import Answer, answer_to_json, answer_to_player_json
+
+logger = logging.getLogger(__name__)
+
+IMAGE_URL_PATTERN = re.compile(r"^(https?://[^/]+)?(?P<prefix>/quizzes/[^/]+)?/questions/(?P<id>\d+)/image(\?.*)?$")
+
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
 
 class Question:
-    def __init__(self, title, position, text, image_bytes: bytes, possible_answers=None,question_id=None):
+    __slots__ = ('id', 'title', 'position', 'text', 'image', 'image_hash', 'image_updated_at', 'possible_answers',
+                 'url_prefix')
+
+    def __init__(self, title, position, text, image_bytes: bytes, possible_answers=None,question_id=None,
+                 image_hash=None, image_updated_at=None, url_prefix=""):
         self.id = question_id
         self.title = title
         self.position = position
         self.text = text
         self.image = image_bytes
+        self.image_hash = image_hash
+        self.image_updated_at = image_updated_at
         self.possible_answers = possible_answers if possible_answers is not None else []
+        # Routes of the quiz the question belongs to, '' for the default quiz
+        self.url_prefix = url_prefix
+
+def image_hash(image_bytes: bytes):
+    if not image_bytes:
+        return None
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def image_mime_type(image_bytes: bytes):
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if image_bytes.lstrip()[:5] in (b"<?xml", b"<svg "):
+        return "image/svg+xml"
+    return "application/octet-stream"
+
+def image_url(question):
+    if not question.image_hash:
+        return ''
+    # The content hash in the query string makes the URL change with the image
+    return f"{question.url_prefix}/questions/{question.id}/image?v={question.image_hash[:16]}"
+
+def image_data_uri(image_bytes: bytes):
+    if not image_bytes:
+        return ''
+    return f"data:{image_mime_type(image_bytes)};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+
+def normalize_stored_image(image):
+    """
+    Converts an image stored as data-URI or base64 text to raw bytes.
+    Raw binary images are returned unchanged.
+    """
+    if not image:
+        return b''
+    if isinstance(image, str):
+        image = image.encode('utf-8')
+    if image_mime_type(image) != "application/octet-stream":
+        return image
+    try:
+        return _decode_image(image.decode('ascii'))
+    except (UnicodeDecodeError, ValueError):
+        return image
 
-def question_from_json(json_data):
+def _decode_image(image_base64):
+    if image_base64.startswith("data:"):
+        match = re.match(r"^data:.*?;base64,(.*)$", image_base64, re.DOTALL)
+        if match:
+            image_base64 = match.group(1)
+        else:
+            raise ValueError("Invalid data URI format for image")
+    return base64.b64decode(image_base64)
+
+def question_from_json(json_data, question_id=None, url_prefix=""):
+    """
+    :param question_id: id of the question updated, None for a new one. Its
+    own image URL, sent back as given (url_prefix: that of its quiz), means
+    its image is unchanged; any other image URL is rejected.
+    """
     image_base64 = json_data.get('image', '')
     image_bytes = b''
+    url_match = IMAGE_URL_PATTERN.match(image_base64) if isinstance(image_base64, str) else None
+
+    if image_base64 and url_match:
+        if (question_id is None or int(url_match.group('id')) != question_id
+                or (url_match.group('prefix') or "") != url_prefix):
+            raise ValueError("Image URL must be the one of the question updated")
+        # The client sent back the image URL it was given: image unchanged
+        image_bytes = None
 
-    if image_base64:
+    elif image_base64:
         try:
-            if image_base64.startswith("data:"):
-                match = re.match(r"^data:.*?;base64,(.*)$", image_base64)
-                if match:
-                    image_base64 = match.group(1)
-                else:
-                    raise ValueError("Invalid data URI format for image")
-            image_bytes = base64.b64decode(image_base64)
+            image_bytes = _decode_image(image_base64)
         except Exception as e:
             error_msg = str(e)
             if "number of data characters" in error_msg and "cannot be 1 more than a multiple of 4" in error_msg:
-                print("Invalid base64 padding, skipping image decode: %s", error_msg)
+                logger.warning("Invalid base64 padding, skipping image decode: %s", error_msg)
                 image_bytes = image_base64.encode('utf-8')
             else:
                 raise ValueError("Image is not valid base64")
@@ -47,32 +127,26 @@ def question_from_json(json_data):
         position=json_data.get('position'),
         text=json_data.get('text'),
         image_bytes=image_bytes,
-        possible_answers=answers
+        possible_answers=answers,
+        image_hash=image_hash(image_bytes)
     )
 
 def question_to_json(question):
-    image_base64 = ''
-    if question.image:
-        try:
-            image_base64 = question.image.decode('utf-8')
-        except UnicodeDecodeError:
-            image_base64 = base64.b64encode(question.image).decode('utf-8')
+    return {
+        "id": question.id,
+        "title": question.title,
+        "position": question.position,
+        "text": question.text,
+        "image": image_url(question),
+        "possibleAnswers": [answer_to_json(answer) for answer in question.possible_answers]
+    }
 
+def question_to_player_json(question):
     return {
         "id": question.id,
         "title": question.title,
         "position": question.position,
         "text": question.text,
-        "image": image_base64,
-        "possibleAnswers": [
-            {
-                k: v for k, v in {
-                    "text": answer.text,
-                    "isCorrect": answer.is_correct,
-                    "latitude": answer.latitude,
-                    "longitude": answer.longitude
-                }.items() if v is not None
-            }
-            for answer in question.possible_answers
-        ]
+        "image": image_url(question),
+        "possibleAnswers": [answer_to_player_json(answer) for answer in question.possible_answers]
     }
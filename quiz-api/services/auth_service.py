@@ -0,0 +1,99 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import deque
+
+# "scrypt$n$r$p$salt$hash" (hex) of the admin password, see hash_password()
+ADMIN_PASSWORD_HASH = os.environ.get(
+    "QUIZ_ADMIN_PASSWORD_HASH",
+    "scrypt$16384$8$1$6fe6e44e23abda15bee46a4df448bd2c$68819531d7b770c795edd16420fabfdafb53511c9500132907dd2c0776316907"
+)
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Login attempts allowed per client address and window, and password checks
+# allowed to run at the same time: each one costs ~50 ms of CPU and 16 MB
+LOGIN_MAX_ATTEMPTS = int(os.environ.get("QUIZ_LOGIN_MAX_ATTEMPTS", "10"))
+LOGIN_WINDOW = float(os.environ.get("QUIZ_LOGIN_WINDOW_S", "60"))
+LOGIN_CONCURRENCY = int(os.environ.get("QUIZ_LOGIN_CONCURRENCY", "2"))
+
+
+def hash_password(password, salt=None):
+    """
+    :return: the stored form of a password, for QUIZ_ADMIN_PASSWORD_HASH
+    """
+    salt = salt or os.urandom(16)
+    derived = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${derived.hex()}"
+
+
+def verify_password(password, stored=ADMIN_PASSWORD_HASH):
+    algorithm, n, r, p, salt, expected = stored.split('$')
+    if algorithm != "scrypt":
+        raise ValueError(f"Unsupported password hash '{algorithm}'")
+
+    derived = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(salt),
+                             n=int(n), r=int(r), p=int(p), dklen=len(expected) // 2)
+    return hmac.compare_digest(derived, bytes.fromhex(expected))
+
+
+class LoginRateLimiter:
+    """
+    Sliding-window count of login attempts per client address, plus a cap
+    on concurrent password checks, so that brute force cannot saturate the
+    workers with key derivations.
+    """
+
+    def __init__(self, max_attempts=LOGIN_MAX_ATTEMPTS, window=LOGIN_WINDOW, concurrency=LOGIN_CONCURRENCY):
+        self.max_attempts = max_attempts
+        self.window = window
+        self._lock = threading.Lock()
+        self._attempts = {}
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def attempt(self, client):
+        """
+        Records an attempt.
+        :return: seconds to wait before retrying, or 0 when allowed
+        """
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(client)
+            if attempts is None:
+                if len(self._attempts) >= 10000:
+                    self._prune(now)
+                attempts = self._attempts[client] = deque()
+
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if len(attempts) >= self.max_attempts:
+                return attempts[0] + self.window - now
+
+            attempts.append(now)
+            return 0
+
+    def _prune(self, now):
+        # Lock held by the caller
+        for client in [client for client, attempts in self._attempts.items()
+                       if not attempts or attempts[-1] <= now - self.window]:
+            del self._attempts[client]
+
+    def acquire(self):
+        """
+        :return: False when too many password checks are already running
+        """
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+    def reset(self):
+        with self._lock:
+            self._attempts.clear()
+
+
+login_rate_limiter = LoginRateLimiter()
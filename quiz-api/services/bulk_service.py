@@ -0,0 +1,266 @@
+from datetime import datetime, timezone
+from models.question_model import question_from_json, image_data_uri
+from services.db_service import get_db_connection, release_db_connection
+from services.question_service import (invalidate_quiz_cache, get_quiz_snapshot, score_submissions,
+                                       bump_participations_version)
+from services.rank_service import get_score_ranking
+from services.stats_service import answer_columns, encode_points, get_quiz_stats
+from services.participation_writer import get_participation_writer
+from services.metrics_service import timed
+from services.image_service import (encode_images, missing_images, store_images, delete_unused_images, read_image_file,
+                                    discard_image_files, remove_image_files)
+
+# Questions whose new images are handed to the encoding pool together
+IMPORT_CHUNK_SIZE = 500
+# Participations scored together, in one distance pass for their map clicks
+PARTICIPATION_CHUNK_SIZE = 1000
+
+
+def _next_id(cur, table):
+    # Ids are assigned here so that answers can be inserted with executemany;
+    # sqlite_sequence keeps AUTOINCREMENT from reusing deleted ids
+    cur.execute(f"""
+        SELECT MAX(
+            COALESCE((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0),
+            COALESCE((SELECT MAX(id) FROM {table}), 0)
+        )
+    """)
+    return cur.fetchone()[0] + 1
+
+
+def _encode_new_images(images, encoded, uploads):
+    # Outside the write lock, as create_question does: the distinct images
+    # not stored yet are encoded in parallel, by the pool, and their upload
+    # is dropped. The others keep theirs, in case they are removed meanwhile.
+    conn = get_db_connection()
+    try:
+        new_hashes = list(missing_images(conn.cursor(), images))
+    finally:
+        release_db_connection(conn)
+    encoded.update(zip(new_hashes, encode_images([images.pop(h) for h in new_hashes])))
+    uploads.update(images)
+    images.clear()
+
+
+def _read_questions(questions_json):
+    """
+    Parses the whole import and encodes its new images, before any write
+    lock is taken.
+    :return: (questions, encoded, uploads): list of (title, text, image_hash,
+    answer rows), dict of image hash -> variants of the new images, dict of
+    image hash -> upload of the images already stored
+    """
+    questions = []
+    encoded = {}
+    uploads = {}
+    images = {}
+
+    for json_data in questions_json:
+        question = question_from_json(json_data)
+        questions.append((
+            question.title, question.text, question.image_hash,
+            [(answer.text, int(answer.is_correct), answer.latitude, answer.longitude)
+             for answer in question.possible_answers]
+        ))
+        if question.image and question.image_hash not in encoded and question.image_hash not in uploads:
+            images[question.image_hash] = question.image
+        if len(images) >= IMPORT_CHUNK_SIZE:
+            _encode_new_images(images, encoded, uploads)
+
+    _encode_new_images(images, encoded, uploads)
+    return questions, encoded, uploads
+
+
+def _store_new_images(cur, encoded, uploads):
+    # Only the images removed since they were checked are encoded under the lock
+    missing = missing_images(cur, list(encoded) + list(uploads))
+    late = [h for h in missing if h not in encoded]
+    new_images = {h: encoded[h] for h in missing if h in encoded}
+    new_images.update(zip(late, encode_images([uploads[h] for h in late])))
+    return store_images(cur, new_images)
+
+
+@timed
+def import_questions(questions_json, replace=False):
+    """
+    Imports questions in a single transaction, in iteration order: after the
+    current last question, or in place of the whole bank when replace is set.
+    Positions follow the import order, the 'position' fields are ignored.
+    The import is parsed and its images encoded before the write lock is
+    taken: the transaction only inserts rows and writes image files.
+    :param questions_json: iterable of question dicts
+    :return: number of imported questions
+    """
+    questions, encoded, uploads = _read_questions(questions_json)
+    conn = get_db_connection()
+    cur = conn.cursor()
+    written = []
+    unused = []
+
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+
+        if replace:
+            cur.execute("DELETE FROM answers")
+            cur.execute("DELETE FROM questions")
+
+        cur.execute("SELECT COALESCE(MAX(position), 0) FROM questions")
+        (position,) = cur.fetchone()
+        first_id = _next_id(cur, "questions")
+        now = datetime.now(timezone.utc).isoformat()
+
+        written = _store_new_images(cur, encoded, uploads)
+        cur.executemany("""
+            INSERT INTO questions (id, title, position, text, image_hash, image_updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(first_id + i, title, position + 1 + i, text, image_hash, now)
+              for i, (title, text, image_hash, _) in enumerate(questions)])
+        cur.executemany("""
+            INSERT INTO answers (question_id, text, is_correct, latitude, longitude)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(first_id + i,) + answer
+              for i, (_, _, _, answers) in enumerate(questions) for answer in answers])
+
+        if replace:
+            unused = delete_unused_images(cur)
+
+        cur.execute("COMMIT")
+        invalidate_quiz_cache()
+
+    except Exception as e:
+        discard_image_files(written)
+        cur.execute("ROLLBACK")
+        raise e
+
+    finally:
+        release_db_connection(conn)
+
+    remove_image_files(unused)
+    return len(questions)
+
+
+def _participation_chunks(participations_json):
+    chunk = []
+    for line_number, json_data in enumerate(participations_json, start=1):
+        if (not isinstance(json_data, dict) or not isinstance(json_data.get('playerName'), str)
+                or not isinstance(json_data.get('answers'), list)):
+            raise ValueError(f"Missing playerName or answers on line {line_number}")
+        chunk.append((json_data['playerName'], json_data['answers']))
+        if len(chunk) >= PARTICIPATION_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@timed
+def import_participations(participations_json):
+    """
+    Scores and stores participations collected elsewhere, e.g. offline, in a
+    single transaction. Each chunk is scored at once: the distances of all
+    its map clicks are computed in one vectorized pass.
+    :param participations_json: iterable of {"playerName", "answers"} dicts,
+    consumed lazily
+    :return: number of imported participations
+    """
+    snapshot = get_quiz_snapshot()
+    # Before the write transaction: a new layout is committed on its own
+    layout_id, _ = answer_columns(snapshot.question_ids, ())
+    # Queued participations have ids already: reserve ours from the queue
+    writer = get_participation_writer(on_commit=bump_participations_version)
+    date = datetime.now(timezone.utc).isoformat()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+    stored = []
+
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        participation_id = None if writer is not None else _next_id(cur, "participations")
+
+        for chunk in _participation_chunks(participations_json):
+            scored = score_submissions(snapshot.answer_key, [answers for _, answers in chunk], snapshot.geo_key)
+            if writer is not None:
+                participation_id = writer.reserve_ids(len(chunk))
+            rows = []
+            for (player_name, _), points in zip(chunk, scored):
+                rows.append((participation_id, player_name, sum(points), date, layout_id, encode_points(points)))
+                stored.append((participation_id, sum(points), points))
+                participation_id += 1
+            cur.executemany("""
+                INSERT INTO participations (id, player_name, score, date, layout_id, points)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+
+        cur.execute("COMMIT")
+
+    except Exception as e:
+        cur.execute("ROLLBACK")
+        raise e
+
+    finally:
+        release_db_connection(conn)
+
+    score_ranking = get_score_ranking()
+    quiz_stats = get_quiz_stats()
+    for participation_id, score, points in stored:
+        score_ranking.add(score, participation_id)
+        quiz_stats.add(participation_id, score, date, snapshot.question_ids, points)
+    bump_participations_version()
+    return len(stored)
+
+
+def iter_questions_export():
+    """
+    Yields every question with its answers and its full size image as a data
+    URI, in position order. Questions and answers are read through two lazy
+    cursors walked side by side, so memory stays flat whatever the bank size.
+    """
+    conn = get_db_connection()
+    questions_cur = conn.cursor()
+    answers_cur = conn.cursor()
+
+    try:
+        # One read transaction: both cursors see the same bank
+        questions_cur.execute("BEGIN")
+        questions_cur.execute("""
+            SELECT q.id, q.title, q.position, q.text, i.file
+            FROM questions q
+            LEFT JOIN images i ON i.hash = q.image_hash AND i.variant = 'full'
+            ORDER BY q.position ASC
+        """)
+        answers_cur.execute("""
+            SELECT a.question_id, a.text, a.is_correct, a.latitude, a.longitude
+            FROM answers a
+            JOIN questions q ON q.id = a.question_id
+            ORDER BY q.position ASC, a.id ASC
+        """)
+
+        answer = answers_cur.fetchone()
+        for question_id, title, position, text, image_file in questions_cur:
+            possible_answers = []
+            while answer is not None and answer[0] == question_id:
+                _, answer_text, is_correct, latitude, longitude = answer
+                possible_answers.append({
+                    k: v for k, v in {
+                        "text": answer_text,
+                        "isCorrect": bool(is_correct),
+                        "latitude": latitude,
+                        "longitude": longitude
+                    }.items() if v is not None
+                })
+                answer = answers_cur.fetchone()
+
+            yield {
+                "id": question_id,
+                "title": title,
+                "position": position,
+                "text": text,
+                "image": image_data_uri(read_image_file(image_file)) if image_file else "",
+                "possibleAnswers": possible_answers
+            }
+
+        questions_cur.execute("COMMIT")
+
+    finally:
+        release_db_connection(conn)
@@ -0,0 +1,130 @@
+import itertools
+import threading
+import uuid
+from services.geo_service import GeoIndex
+
+# Distinguishes the content versions of this process from those of a
+# previous run, for ETags built from the versions
+BOOT_ID = uuid.uuid4().hex[:8]
+
+# Versions are drawn from one sequence for the whole process: a quiz reopened
+# after eviction, or another quiz, never reuses a version, so ETags and the
+# payload cache keys built from them stay unambiguous
+_versions = itertools.count(1)
+
+
+class VersionCounter:
+    """Monotonic content version, bumped after each committed write."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = next(_versions)
+
+    @property
+    def value(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value = next(_versions)
+
+
+class QuizSnapshot:
+    """Read-only in-memory copy of the quiz at a given content version."""
+
+    def __init__(self, version, questions, answer_key):
+        self.version = version
+        self.questions = questions
+        # In position order, the layout of the answers of this version
+        self.question_ids = tuple(question.id for question in questions)
+        self.by_position = {question.position: question for question in questions}
+        self.by_id = {question.id: question for question in questions}
+        self.answer_key = answer_key
+        self._payloads = {}
+
+        # Map answers: position -> index of the correct answer locations of
+        # the question, a click scoring by its distance to the nearest one;
+        # and an index of every answer location for nearest lookups
+        correct_entries = {}
+        geo_entries = []
+        for question in questions:
+            for answer in question.possible_answers:
+                if answer.latitude is None or answer.longitude is None:
+                    continue
+                geo_entries.append((answer.latitude, answer.longitude, (question, answer)))
+                if answer.is_correct:
+                    correct_entries.setdefault(question.position, []).append(
+                        (answer.latitude, answer.longitude, answer))
+        self.geo_key = {position: GeoIndex(entries) for position, entries in correct_entries.items()}
+        self.geo_index = GeoIndex(geo_entries)
+
+        # Everything scoring depends on. Sessions compare it instead of the
+        # version: a quiz evicted then reopened unchanged gets a new version
+        self.scoring_key = (
+            self.question_ids,
+            tuple((position, tuple(flags)) for position, flags in answer_key.items()),
+            tuple((position, tuple((latitude, longitude) for latitude, longitude, _ in entries))
+                  for position, entries in correct_entries.items())
+        )
+
+    def payload(self, key, build):
+        """
+        Serialized response for this version, built on first use. Two threads
+        may both build a missing payload: the results are identical.
+        """
+        data = self._payloads.get(key)
+        if data is None:
+            data = self._payloads[key] = build()
+        return data
+
+
+class QuizCache:
+    """
+    Versioned quiz snapshot, rebuilt lazily from the database.
+    Every write to the quiz content must call invalidate() once committed.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._version = next(_versions)
+        self._snapshot = None
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.invalidations = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self):
+        with self._lock:
+            if self._snapshot is not None:
+                self.hits += 1
+                return self._snapshot
+
+            self.misses += 1
+            # Built under the lock: an invalidate() racing with the load waits
+            # for it and then drops the possibly stale snapshot.
+            self._snapshot = self._loader(self._version)
+            self.rebuilds += 1
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._version = next(_versions)
+            self._snapshot = None
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self._version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rebuilds": self.rebuilds,
+                "invalidations": self.invalidations,
+                "hitRate": self.hits / lookups if lookups else None
+            }
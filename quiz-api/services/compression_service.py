@@ -0,0 +1,139 @@
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from services.metrics_service import register_collector
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent as is: compression would not pay
+COMPRESS_MIN_SIZE = int(os.environ.get("QUIZ_COMPRESS_MIN_BYTES", "1024"))
+# Budget of the cache of compressed payloads, in bytes
+PAYLOAD_CACHE_SIZE = int(os.environ.get("QUIZ_COMPRESS_CACHE_MB", "32")) * 1024 * 1024
+
+# Content-Encoding values, preferred first when the client accepts several
+ENCODINGS = tuple(name for name, available in (
+    ("zstd", zstandard is not None),
+    ("br", brotli is not None),
+    ("gzip", True),
+) if available)
+
+# Per-request compression favours speed; payloads compressed once per quiz
+# version can afford the densest levels that still build in milliseconds
+DYNAMIC_LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+STATIC_LEVELS = {"zstd": 19, "br": 9, "gzip": 9}
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Bytes given to and returned by compress(), for the bytes saved
+_stats_lock = threading.Lock()
+_bytes_in = 0
+_bytes_out = 0
+
+
+def negotiate(accept_encodings):
+    """
+    :param accept_encodings: werkzeug MIMEAccept of the Accept-Encoding header
+    :return: the encoding to use, None for identity
+    """
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, levels=DYNAMIC_LEVELS):
+    global _bytes_in, _bytes_out
+    level = levels[encoding]
+    if encoding == "gzip":
+        compressed = gzip.compress(data, compresslevel=level, mtime=0)
+    elif encoding == "br":
+        compressed = brotli.compress(data, quality=level)
+    else:
+        compressed = zstandard.ZstdCompressor(level=level).compress(data)
+    with _stats_lock:
+        _bytes_in += len(data)
+        _bytes_out += len(compressed)
+    return compressed
+
+
+class PayloadCache:
+    """
+    Compressed payloads by (key, encoding), least recently used first,
+    bounded by their total size. Keys carry the content version, so stale
+    entries are never hit and age out.
+    """
+
+    def __init__(self, max_bytes=PAYLOAD_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        # Built outside the lock: two threads may both build a missing entry
+        data = build()
+        with self._lock:
+            if key not in self._entries and len(data) <= self.max_bytes:
+                self._entries[key] = data
+                self.size += len(data)
+                while self.size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+payload_cache = PayloadCache()
+
+
+def encode_payload(key, data, encoding):
+    """
+    Compressed form of a payload that only changes with `key`, built once.
+    :return: (body, encoding), encoding None when the body is sent as is
+    """
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return data, None
+    return payload_cache.get((key, encoding), lambda: compress(data, encoding, STATIC_LEVELS)), encoding
+
+
+def _collect_metrics():
+    return [
+        ("quiz_compression_input_bytes_total", "counter", "Bytes compressed.", _bytes_in),
+        ("quiz_compression_output_bytes_total", "counter", "Bytes produced by compression.", _bytes_out),
+        ("quiz_compression_cache_hits_total", "counter", "Compressed payloads served from the cache.",
+         payload_cache.hits),
+        ("quiz_compression_cache_misses_total", "counter", "Compressed payloads built.", payload_cache.misses),
+        ("quiz_compression_cache_entries", "gauge", "Compressed payloads cached.", len(payload_cache)),
+        ("quiz_compression_cache_bytes", "gauge", "Size of the cached compressed payloads.", payload_cache.size),
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,409 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from services.metrics_service import (METRICS_ENABLED, record_query, db_connections_opened, db_connections_closed,
+                                      register_collector)
+
+# Database of the default quiz, the one served by the unprefixed routes
+DB_PATH = 'quiz-db.db'
+DEFAULT_QUIZ = "default"
+# Other quizzes live in <data dir>/<quiz id>/quiz-db.db, next to DB_PATH by default
+DATA_DIR = os.environ.get("QUIZ_DATA_DIR")
+POOL_SIZE = 8
+# Quiz databases kept open; the least recently used idle one is closed beyond
+MAX_OPEN_DATABASES = int(os.environ.get("QUIZ_OPEN_DATABASES", "64"))
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QuizRetired(RuntimeError):
+    """The quiz database is being deleted: it takes no new users."""
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Counts statements and their execution time (up to the first row)."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(time.perf_counter() - start)
+
+
+class PooledConnection(sqlite3.Connection):
+    # Pool generation the connection was opened in, see QuizDatabase.reset()
+    generation = 0
+    # QuizDatabase the connection belongs to
+    database = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or (TimedCursor if METRICS_ENABLED else sqlite3.Cursor))
+
+    def close(self):
+        db_connections_closed.inc()
+        super().close()
+
+
+class QuizDatabase:
+    """
+    The SQLite file of one quiz with its connection pool, and the in-memory
+    state built from it (snapshot cache, ranking...), attached by the
+    services that own it so that each quiz has its own.
+    """
+
+    def __init__(self, quiz_id, path):
+        self.id = quiz_id
+        self.path = path
+        self.users = 0
+        # Set once the open hooks (migrations) ran
+        self.ready = threading.Event()
+        self.failed = False
+        self._pool = queue.LifoQueue(maxsize=POOL_SIZE)
+        self._generation = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._state = {}
+
+    @property
+    def url_prefix(self):
+        return "" if self.id == DEFAULT_QUIZ else f"/quizzes/{self.id}"
+
+    def open_connection(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False)
+        conn.isolation_level = None
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn.generation = self._generation
+        conn.database = self
+        db_connections_opened.inc()
+        return conn
+
+    def get_connection(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                return self.open_connection()
+
+            if conn.generation == self._generation:
+                return conn
+            conn.close()
+
+    def release_connection(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+        if conn.generation != self._generation or self.closed:
+            conn.close()
+            return
+
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def reset(self):
+        """
+        Closes idle connections and retires the ones in use, e.g. before the
+        database file is replaced.
+        """
+        self._generation += 1
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def attach(self, key, factory):
+        """
+        :return: the state stored under key, created with factory() on first use
+        """
+        state = self._state.get(key)
+        if state is None:
+            with self._lock:
+                state = self._state.get(key)
+                if state is None:
+                    state = self._state[key] = factory()
+        return state
+
+    def attached(self, key):
+        return self._state.get(key)
+
+    def close(self):
+        # State first: a write-behind queue still needs the connections
+        for state in list(self._state.values()):
+            if hasattr(state, "close"):
+                try:
+                    state.close()
+                except Exception:
+                    logger.exception("Error closing the state of quiz %s", self.id)
+        self.closed = True
+        self.reset()
+
+
+class QuizDatabases:
+    """
+    Open quiz databases, least recently used first. Beyond max_open, idle
+    ones are closed, and reopened on their next request.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_DATABASES):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        # Signaled when a database is released
+        self._released = threading.Condition(self._lock)
+        self._databases = OrderedDict()
+        # Quizzes being deleted, refused by acquire()
+        self._retired = set()
+        self._open_hooks = []
+        self._default = None
+        self._default_lock = threading.Lock()
+        self.opened = 0
+        self.evicted = 0
+
+    def on_open(self, hook):
+        """
+        Registers hook(), called with the database current each time one is opened.
+        """
+        self._open_hooks.append(hook)
+
+    def acquire(self, quiz_id):
+        """
+        :return: the open database of a quiz, marked in use until release()
+        """
+        with self._lock:
+            if quiz_id in self._retired:
+                raise QuizRetired(f"Quiz '{quiz_id}' is being deleted")
+            database = self._databases.get(quiz_id)
+            opening = database is None
+            if opening:
+                database = self._databases[quiz_id] = QuizDatabase(quiz_id, quiz_db_path(quiz_id))
+                self.opened += 1
+            else:
+                self._databases.move_to_end(quiz_id)
+            database.users += 1
+            evicted = self._evict() if opening else []
+
+        # Outside the lock: closing may flush a write-behind queue, and
+        # opening may migrate the database
+        for other in evicted:
+            other.close()
+
+        if not opening:
+            database.ready.wait()
+            if database.failed:
+                self.release(database)
+                raise RuntimeError(f"Quiz database '{quiz_id}' could not be opened")
+            return database
+
+        try:
+            with use_database(database):
+                for hook in self._open_hooks:
+                    hook()
+        except Exception:
+            database.failed = True
+            self.release(database)
+            self.close(quiz_id)
+            raise
+        finally:
+            database.ready.set()
+        return database
+
+    def _evict(self):
+        # Lock held by the caller
+        evicted = []
+        for database in list(self._databases.values()):
+            if len(self._databases) <= self.max_open:
+                break
+            if database.users == 0:
+                del self._databases[database.id]
+                evicted.append(database)
+        self.evicted += len(evicted)
+        return evicted
+
+    def default(self):
+        """
+        :return: the default quiz database, acquired once and never released
+        """
+        database = self._default
+        if database is None or database.closed:
+            with self._default_lock:
+                if self._default is None or self._default.closed:
+                    self._default = self.acquire(DEFAULT_QUIZ)
+                database = self._default
+        return database
+
+    def release(self, database):
+        with self._lock:
+            database.users -= 1
+            if database.users == 0:
+                self._released.notify_all()
+
+    def retire(self, quiz_id, timeout):
+        """
+        Refuses new users of a quiz database, then closes it once the users
+        in flight (requests, streamed bodies) released it, before its files
+        are deleted. Refused until restore().
+        :return: False when its users did not finish within timeout: the
+        database then stays open and is usable again
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._retired.add(quiz_id)
+            database = self._databases.get(quiz_id)
+            while database is not None and database.users > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._retired.discard(quiz_id)
+                    return False
+                self._released.wait(remaining)
+            self._databases.pop(quiz_id, None)
+        # Outside the lock: closing flushes a write-behind queue
+        if database is not None:
+            database.close()
+        return True
+
+    def restore(self, quiz_id):
+        """
+        Accepts users of a retired quiz id again, once its files are deleted.
+        """
+        with self._lock:
+            self._retired.discard(quiz_id)
+
+    def close(self, quiz_id):
+        with self._lock:
+            database = self._databases.pop(quiz_id, None)
+        if database is not None:
+            database.close()
+
+    def close_all(self):
+        with self._lock:
+            databases = list(self._databases.values())
+            self._databases.clear()
+        for database in databases:
+            database.close()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._databases.values()))
+
+    def __len__(self):
+        return len(self._databases)
+
+
+databases = QuizDatabases()
+# Durable shutdown: closing a database first commits its queued participations
+atexit.register(databases.close_all)
+
+_current_database = ContextVar("quiz_database", default=None)
+
+
+def data_dir():
+    return DATA_DIR or os.path.join(os.path.dirname(DB_PATH), "quizzes")
+
+
+def quiz_db_path(quiz_id):
+    if quiz_id == DEFAULT_QUIZ:
+        return DB_PATH
+    return os.path.join(data_dir(), quiz_id, "quiz-db.db")
+
+
+@contextmanager
+def use_database(database):
+    """
+    Makes database the current one, for get_db_connection() and the state
+    attached to it, in this thread or task.
+    """
+    token = _current_database.set(database)
+    try:
+        yield database
+    finally:
+        _current_database.reset(token)
+
+
+@contextmanager
+def use_quiz(quiz_id):
+    """
+    Opens the database of a quiz if needed, and makes it current.
+    """
+    database = databases.acquire(quiz_id)
+    try:
+        with use_database(database):
+            yield database
+    finally:
+        databases.release(database)
+
+
+def current_database():
+    """
+    :return: the database of the current quiz, the default quiz outside use_quiz()
+    """
+    database = _current_database.get()
+    if database is None:
+        return databases.default()
+    return database
+
+
+def open_db_connection():
+    """
+    Opens a tuned connection to the current quiz database, outside of the pool
+    :return: sqlite3.Connection
+    """
+    return current_database().open_connection()
+
+
+def get_db_connection():
+    """
+    Takes an idle connection of the current quiz from its pool, or opens a
+    new one. Must be handed back with release_db_connection().
+    :return: sqlite3.Connection
+    """
+    return current_database().get_connection()
+
+
+def release_db_connection(conn):
+    conn.database.release_connection(conn)
+
+
+def reset_db_connections():
+    """
+    Closes every open quiz database, e.g. before the database files are
+    replaced. They are reopened on next use.
+    """
+    databases.close_all()
+
+
+def _collect_metrics():
+    return [
+        ("quiz_databases_open", "gauge", "Quiz databases open.", len(databases)),
+        ("quiz_databases_opened_total", "counter", "Quiz databases opened.", databases.opened),
+        ("quiz_databases_evicted_total", "counter", "Idle quiz databases closed by the LRU.", databases.evicted),
+    ]
+
+
+register_collector(_collect_metrics)
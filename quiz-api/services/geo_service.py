@@ -0,0 +1,190 @@
+import bisect
+import math
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Points for a map-click answer by distance to the correct answer:
+# "max_km:points" pairs, e.g. QUIZ_GEO_BANDS="10:3,50:2,200:1"
+GEO_BANDS = tuple(sorted(
+    (float(limit), int(points))
+    for limit, points in (band.split(":") for band in os.environ.get("QUIZ_GEO_BANDS", "50:1").split(","))
+))
+
+# Below this many points the plain Python loop is faster than numpy
+VECTORIZE_MIN_POINTS = 16
+# Up to this many locations, a point is measured against each of them in the
+# vectorized pass; beyond, the index finds the nearest one
+BRUTE_FORCE_MAX_LOCATIONS = 32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    h = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def distances_km(points, targets):
+    """
+    Great-circle distances between two equally long lists of (lat, lon),
+    computed in one vectorized pass when numpy is installed.
+    """
+    if np is None or len(points) < VECTORIZE_MIN_POINTS:
+        return [haversine_km(*point, *target) for point, target in zip(points, targets)]
+
+    lat1, lon1 = np.radians(np.asarray(points, dtype=float)).T
+    lat2, lon2 = np.radians(np.asarray(targets, dtype=float)).T
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))).tolist()
+
+
+def nearest_distances_km(points, indexes):
+    """
+    Great-circle distance from each point to the closest location of its
+    GeoIndex (an equally long list). Small indexes are measured in full, the
+    pairs of every point in one vectorized pass; large ones are searched.
+    """
+    distances = [math.inf] * len(points)
+    owners, pair_points, pair_targets = [], [], []
+    for number, (point, index) in enumerate(zip(points, indexes)):
+        if len(index) > BRUTE_FORCE_MAX_LOCATIONS:
+            distances[number] = index.nearest(*point)[1]
+            continue
+        for location in index.locations:
+            owners.append(number)
+            pair_points.append(point)
+            pair_targets.append(location)
+
+    for number, distance in zip(owners, distances_km(pair_points, pair_targets)):
+        if distance < distances[number]:
+            distances[number] = distance
+    return distances
+
+
+def band_points(distances, bands=GEO_BANDS):
+    """
+    :return: total points of a list of distances, each scored by the first
+    (closest) band it falls into
+    """
+    limits = [limit for limit, _ in bands]
+    values = [value for _, value in bands] + [0]
+    return sum(values[bisect.bisect_left(limits, distance)] for distance in distances)
+
+
+def valid_coordinates(latitude, longitude):
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def _haversine_term(angle_degrees):
+    return math.sin(math.radians(angle_degrees) / 2) ** 2
+
+
+class GeoIndex:
+    """
+    Points bucketed into 1-degree latitude rows, each sorted by longitude.
+    A search visits rows by increasing latitude gap and, within a row, only
+    the longitude window that can still beat the best distance found, so
+    far-away points are never measured.
+    """
+
+    ROW_DEGREES = 1.0
+
+    def __init__(self, entries):
+        # entries: iterable of (latitude, longitude, item)
+        rows = {}
+        self.locations = []
+        for latitude, longitude, item in entries:
+            self.locations.append((latitude, longitude))
+            row = math.floor((latitude + 90) / self.ROW_DEGREES)
+            rows.setdefault(row, []).append((longitude, latitude, item))
+
+        self._rows = {row: sorted(points, key=lambda point: point[0]) for row, points in rows.items()}
+        self._longitudes = {row: [point[0] for point in points] for row, points in self._rows.items()}
+        self._row_keys = sorted(self._rows)
+        self._size = sum(len(points) for points in self._rows.values())
+
+    def __len__(self):
+        return self._size
+
+    def _row_gap(self, row, latitude):
+        low = row * self.ROW_DEGREES - 90
+        high = low + self.ROW_DEGREES
+        if latitude < low:
+            return low - latitude
+        if latitude > high:
+            return latitude - high
+        return 0.0
+
+    def _longitude_window(self, row, latitude, best_distance):
+        # Largest longitude gap that can still beat best_distance, from the
+        # haversine formula at the most favourable latitude of the row
+        if best_distance == math.inf:
+            return 180.0
+        low = row * self.ROW_DEGREES - 90
+        widest = max(abs(low), abs(low + self.ROW_DEGREES))
+        cos_product = math.cos(math.radians(latitude)) * math.cos(math.radians(min(widest, 90)))
+        remaining = (math.sin(min(best_distance / EARTH_RADIUS_KM, math.pi) / 2) ** 2
+                     - _haversine_term(self._row_gap(row, latitude)))
+        if remaining < 0:
+            return -1.0
+        if cos_product <= 1e-12 or remaining >= cos_product:
+            return 180.0
+        return math.degrees(2 * math.asin(math.sqrt(remaining / cos_product)))
+
+    def _search_row(self, row, latitude, longitude, best):
+        points = self._rows[row]
+        count = len(points)
+        start = bisect.bisect_left(self._longitudes[row], longitude)
+        # Walk outwards on both sides, wrapping around the antimeridian
+        left, right = start - 1, start
+        for _ in range(count):
+            window = self._longitude_window(row, latitude, best[1])
+            left_gap = abs((longitude - points[left % count][0] + 180) % 360 - 180)
+            right_gap = abs((points[right % count][0] - longitude + 180) % 360 - 180)
+            if min(left_gap, right_gap) > window:
+                return
+
+            if left_gap <= right_gap:
+                index, left = left % count, left - 1
+            else:
+                index, right = right % count, right + 1
+
+            point_longitude, point_latitude, item = points[index]
+            distance = haversine_km(latitude, longitude, point_latitude, point_longitude)
+            if distance < best[1]:
+                best[0], best[1] = item, distance
+
+    def nearest(self, latitude, longitude):
+        """
+        :return: (item, distance_km) of the closest point, or None when empty
+        """
+        best = [None, math.inf]
+        query_row = math.floor((latitude + 90) / self.ROW_DEGREES)
+        above = bisect.bisect_left(self._row_keys, query_row)
+        below = above - 1
+
+        while below >= 0 or above < len(self._row_keys):
+            gap_below = self._row_gap(self._row_keys[below], latitude) if below >= 0 else math.inf
+            gap_above = self._row_gap(self._row_keys[above], latitude) if above < len(self._row_keys) else math.inf
+
+            # A degree of latitude is a fixed distance: rows further away
+            # than the best distance cannot hold a closer point
+            if min(gap_below, gap_above) * KM_PER_DEGREE > best[1]:
+                break
+
+            if gap_below <= gap_above:
+                row, below = self._row_keys[below], below - 1
+            else:
+                row, above = self._row_keys[above], above + 1
+            self._search_row(row, latitude, longitude, best)
+
+        if best[0] is None:
+            return None
+        return best[0], best[1]
@@ -0,0 +1,260 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from models.question_model import image_mime_type
+from services import db_service
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# Longest side of each variant, smallest first. Variants larger than the
+# upload are not stored: lookups fall back to the next larger one.
+VARIANTS = (("thumb", 160), ("mobile", 720), ("full", 1600))
+VARIANT_NAMES = tuple(name for name, _ in VARIANTS)
+
+# Encoding runs in this many worker processes (0: in the calling thread)
+IMAGE_WORKERS = int(os.environ.get("QUIZ_IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+WEBP_QUALITY = 80
+
+# Variant files of the default quiz, named by the sha256 of their content.
+# Next to the database by default, so that each database has its own store;
+# the other quizzes always keep theirs next to their database.
+IMAGE_DIR = os.environ.get("QUIZ_IMAGE_DIR")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _output_format(image):
+    if features.check("webp"):
+        return "WEBP", "image/webp", {"quality": WEBP_QUALITY, "method": 4}
+    if image.mode == "RGBA":
+        return "PNG", "image/png", {"optimize": True}
+    return "JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}
+
+
+def encode_variants(data):
+    """
+    Decodes an upload once and encodes its variants. Runs in a worker process.
+    :return: list of (variant, mime_type, width, height, bytes). Images Pillow
+    cannot decode, or animated ones, are kept as uploaded under 'full'.
+    """
+    original = [("full", image_mime_type(data), None, None, data)]
+    if Image is None:
+        return original
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if getattr(image, "is_animated", False):
+                return original
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except Exception:
+        return original
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    image_format, mime_type, options = _output_format(image)
+
+    variants = []
+    for name, max_side in VARIANTS:
+        if name != "full" and max(image.size) <= max_side:
+            continue
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = io.BytesIO()
+        resized.save(output, image_format, **options)
+        variants.append((name, mime_type, resized.width, resized.height, output.getvalue()))
+
+    # Never store a "compact" full variant bigger than the upload
+    full = variants[-1]
+    if len(full[4]) >= len(data) and max(image.size) <= VARIANTS[-1][1]:
+        variants[-1] = ("full", image_mime_type(data), image.width, image.height, data)
+    return variants
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs server threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=get_context("spawn"))
+        return _pool
+
+
+def encode_images(uploads):
+    """
+    Encodes the variants of several uploads, in parallel in the worker
+    processes: the GIL stays free for the threads serving requests.
+    :return: list of variant lists, in the order of uploads
+    """
+    if not uploads:
+        return []
+    if IMAGE_WORKERS <= 0 or Image is None:
+        return [encode_variants(data) for data in uploads]
+    return list(_get_pool().map(encode_variants, uploads))
+
+
+def missing_images(cur, image_hashes):
+    """
+    :return: the hashes not in the image store yet
+    """
+    missing = set()
+    for image_hash in set(filter(None, image_hashes)):
+        cur.execute("SELECT 1 FROM images WHERE hash = ? AND variant = 'full'", (image_hash,))
+        if cur.fetchone() is None:
+            missing.add(image_hash)
+    return missing
+
+
+def image_dir():
+    database = db_service.current_database()
+    if database.id == db_service.DEFAULT_QUIZ and IMAGE_DIR:
+        return os.path.abspath(IMAGE_DIR)
+    return os.path.join(os.path.dirname(os.path.abspath(database.path)), "quiz-images")
+
+
+def image_file_path(file):
+    # Two-level fan-out keeps directories small
+    return os.path.join(image_dir(), file[:2], file)
+
+
+def _write_file(file, data):
+    # :return: whether the file was written, False when it existed already
+    path = image_file_path(file)
+    if os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside then renamed: readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def _unlink_file(file):
+    try:
+        os.unlink(image_file_path(file))
+    except FileNotFoundError:
+        pass
+
+
+def write_image_file(data, written=None):
+    """
+    Writes image bytes to the store, once per distinct content.
+    :param written: list the file name is appended to when the file is new
+    :return: the file name, the sha256 of the content
+    """
+    file = hashlib.sha256(data).hexdigest()
+    if _write_file(file, data) and written is not None:
+        written.append(file)
+    return file
+
+
+def read_image_file(file):
+    with open(image_file_path(file), "rb") as f:
+        return f.read()
+
+
+def store_images(cur, encoded):
+    """
+    Records encoded variants within the caller's transaction, and writes
+    their files.
+    :param encoded: dict of image hash -> variant list from encode_images()
+    :return: the files written, for discard_image_files() if the transaction
+    is rolled back
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [
+        (image_hash, variant, mime_type, width, height, len(data), hashlib.sha256(data).hexdigest(), now, data)
+        for image_hash, variants in encoded.items()
+        for variant, mime_type, width, height, data in variants
+    ]
+    # Rows first: the write lock is then held while the files are written,
+    # so delete_unused_images() cannot remove them in between
+    cur.executemany("""
+        INSERT OR IGNORE INTO images (hash, variant, mime_type, width, height, size, file, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [row[:-1] for row in rows])
+    return [row[6] for row in rows if _write_file(row[6], row[8])]
+
+
+def discard_image_files(files):
+    """
+    Removes the files store_images() wrote, before the caller rolls its
+    transaction back: it still holds the write lock, so no other writer
+    can have recorded them meanwhile.
+    """
+    for file in files:
+        _unlink_file(file)
+
+
+def delete_unused_images(cur):
+    """
+    Deletes the variants no question uses anymore within the caller's
+    transaction, after questions were changed or deleted. Their files stay
+    until the transaction is committed: a rollback keeps them in use.
+    :return: the files no variant uses anymore, for remove_image_files()
+    after the commit
+    """
+    cur.execute("""
+        SELECT DISTINCT file FROM images
+        WHERE hash NOT IN (SELECT image_hash FROM questions WHERE image_hash IS NOT NULL)
+    """)
+    files = [row[0] for row in cur.fetchall()]
+    if not files:
+        return []
+
+    cur.execute("""
+        DELETE FROM images
+        WHERE hash NOT IN (SELECT image_hash FROM questions WHERE image_hash IS NOT NULL)
+    """)
+    unused = []
+    for file in files:
+        # The same content may still be a variant of another image
+        cur.execute("SELECT 1 FROM images WHERE file = ?", (file,))
+        if cur.fetchone() is None:
+            unused.append(file)
+    return unused
+
+
+def remove_image_files(files):
+    """
+    Removes the files delete_unused_images() returned, once its transaction
+    is committed. Checked again under the write lock: a file another
+    transaction recorded since then is kept.
+    """
+    if not files:
+        return
+
+    conn = db_service.get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for file in files:
+                cur.execute("SELECT 1 FROM images WHERE file = ?", (file,))
+                if cur.fetchone() is None:
+                    _unlink_file(file)
+        finally:
+            cur.execute("COMMIT")
+    finally:
+        db_service.release_db_connection(conn)
+
+
+def delete_all_image_files():
+    # After the images table was dropped
+    shutil.rmtree(image_dir(), ignore_errors=True)
@@ -0,0 +1,210 @@
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+# Instrumentation is on unless QUIZ_METRICS=0; the Server-Timing header is
+# opt-in with QUIZ_SERVER_TIMING=1
+METRICS_ENABLED = os.environ.get("QUIZ_METRICS", "1") != "0"
+SERVER_TIMING = os.environ.get("QUIZ_SERVER_TIMING") == "1"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestStats:
+    """Per-request counters filled in by the database and service layers."""
+
+    __slots__ = ('start', 'route', 'db_queries', 'db_time', 'services')
+
+    def __init__(self, route):
+        self.start = time.perf_counter()
+        self.route = route
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.services = {}
+
+
+_current_request = ContextVar("quiz_request_stats", default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Observations only increment a per-bucket count,
+    cumulative counts are computed when the metrics are rendered.
+    """
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+
+        names = self.labelnames + ('le',)
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+http_requests = Counter(
+    "quiz_http_requests_total", "HTTP requests by route and status.", ('method', 'route', 'status'))
+http_duration = Histogram(
+    "quiz_http_request_duration_seconds", "HTTP request latency.", LATENCY_BUCKETS, ('method', 'route'))
+http_response_size = Histogram(
+    "quiz_http_response_size_bytes", "HTTP response body size.", SIZE_BUCKETS, ('route',))
+db_queries = Counter(
+    "quiz_db_queries_total", "SQLite statements executed, by route (empty for background work).", ('route',))
+db_query_time = Counter(
+    "quiz_db_query_seconds_total", "Time spent executing SQLite statements, by route.", ('route',))
+db_connections_opened = Counter("quiz_db_connections_opened_total", "SQLite connections opened.")
+db_connections_closed = Counter("quiz_db_connections_closed_total", "SQLite connections closed.")
+service_duration = Histogram(
+    "quiz_service_duration_seconds", "Service function latency.", LATENCY_BUCKETS, ('function',))
+
+METRICS = [http_requests, http_duration, http_response_size, db_queries, db_query_time,
+           db_connections_opened, db_connections_closed, service_duration]
+
+# Callables returning [(name, type, help, value)] for values owned by other
+# modules (cache counters, writer batches...), read at render time
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def render_metrics():
+    """
+    :return: every metric in the Prometheus text exposition format
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, help_text, value in collector():
+            lines.extend((f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"))
+    return "\n".join(lines) + "\n"
+
+
+def start_request(route):
+    if not METRICS_ENABLED:
+        return None
+    stats = RequestStats(route)
+    _current_request.set(stats)
+    return stats
+
+
+def finish_request(stats, method, status, size):
+    """
+    Records a finished request.
+    :return: its duration in seconds
+    """
+    _current_request.set(None)
+    duration = time.perf_counter() - stats.start
+    http_requests.inc((method, stats.route, status))
+    http_duration.observe(duration, (method, stats.route))
+    if size is not None:
+        http_response_size.observe(size, (stats.route,))
+    if stats.db_queries:
+        db_queries.inc((stats.route,), stats.db_queries)
+        db_query_time.inc((stats.route,), stats.db_time)
+    return duration
+
+
+def record_query(duration):
+    stats = _current_request.get()
+    if stats is None:
+        db_queries.inc(("",))
+        db_query_time.inc(("",), duration)
+    else:
+        stats.db_queries += 1
+        stats.db_time += duration
+
+
+def server_timing(stats, duration):
+    """
+    :return: Server-Timing header value for a finished request
+    """
+    parts = [f'db;dur={stats.db_time * 1000:.2f};desc="{stats.db_queries} queries"']
+    parts.extend(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in stats.services.items())
+    parts.append(f"total;dur={duration * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def timed(f):
+    """
+    Records the latency of a service function, also reported in the
+    Server-Timing header of the request calling it.
+    """
+    if not METRICS_ENABLED:
+        return f
+
+    labels = (f.__name__,)
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            service_duration.observe(elapsed, labels)
+            stats = _current_request.get()
+            if stats is not None:
+                stats.services[f.__name__] = stats.services.get(f.__name__, 0.0) + elapsed
+    return decorated_function
@@ -0,0 +1,262 @@
+from datetime import datetime, timezone
+from models.question_model import image_hash, normalize_stored_image
+from services.db_service import databases, get_db_connection, release_db_connection
+from services.image_service import encode_variants, write_image_file, discard_image_files
+
+
+def _normalize_question_images(cur):
+    # Images used to be stored as data-URI or base64 text: store raw bytes
+    # with their content hash, one row at a time to keep memory flat.
+    cur.execute("SELECT id FROM questions")
+    question_ids = [row[0] for row in cur.fetchall()]
+    now = datetime.now(timezone.utc).isoformat()
+
+    for question_id in question_ids:
+        cur.execute("SELECT image FROM questions WHERE id = ?", (question_id,))
+        image = normalize_stored_image(cur.fetchone()[0])
+        cur.execute("""
+            UPDATE questions SET image = ?, image_hash = ?, image_updated_at = ?
+            WHERE id = ?
+        """, (image, image_hash(image), now, question_id))
+
+
+def _move_question_images(cur):
+    # Move images to the deduplicated image store, encoding their variants
+    # one question at a time, and keep only the hash on the question.
+    cur.execute("SELECT id FROM questions WHERE image_hash IS NOT NULL")
+    question_ids = [row[0] for row in cur.fetchall()]
+    now = datetime.now(timezone.utc).isoformat()
+
+    for question_id in question_ids:
+        cur.execute("SELECT image, image_hash FROM questions WHERE id = ?", (question_id,))
+        image, hash_ = cur.fetchone()
+        cur.execute("SELECT 1 FROM images WHERE hash = ? AND variant = 'full'", (hash_,))
+        if cur.fetchone() is None:
+            cur.executemany("""
+                INSERT INTO images (hash, variant, mime_type, width, height, data, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(hash_, *variant, now) for variant in encode_variants(image)])
+        cur.execute("UPDATE questions SET image = ? WHERE id = ?", (b'', question_id))
+
+
+def _move_images_to_files(cur):
+    # Variant BLOBs become files of the image store, one at a time to keep
+    # memory flat; the table keeps their metadata and file name.
+    cur.execute("SELECT hash, variant FROM images")
+    keys = cur.fetchall()
+    written = []
+
+    for hash_, variant in keys:
+        cur.execute("""
+            SELECT mime_type, width, height, data, created_at FROM images WHERE hash = ? AND variant = ?
+        """, (hash_, variant))
+        mime_type, width, height, data, created_at = cur.fetchone()
+        cur.execute("""
+            INSERT INTO image_files (hash, variant, mime_type, width, height, size, file, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (hash_, variant, mime_type, width, height, len(data), write_image_file(data, written), created_at))
+    return written
+
+
+# Step run after the migration is committed: VACUUM cannot run in a transaction
+VACUUM = "VACUUM"
+
+# Versioned schema migrations, applied in order and recorded in
+# PRAGMA user_version. Each step is an SQL statement or a callable taking
+# the cursor, which returns the image files it wrote, if any: they are
+# removed if the migration is rolled back. Never edit a released
+# migration: append a new one instead.
+MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS "questions" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "title" TEXT NOT NULL,
+            "position" INTEGER NOT NULL,
+            "text" TEXT NOT NULL,
+            "image" BLOB NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "answers" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "question_id" INTEGER NOT NULL,
+            "text" TEXT NOT NULL,
+            "is_correct" INTEGER NOT NULL,
+            "latitude" REAL,
+            "longitude" REAL,
+            FOREIGN KEY("question_id") REFERENCES "questions"("id") ON DELETE CASCADE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "participations" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "player_name" TEXT NOT NULL,
+            "score" INTEGER NOT NULL,
+            "date" TEXT NOT NULL
+        )
+        """,
+    ]),
+    (2, [
+        # Databases created before this migration may hold duplicate or
+        # sparse positions: make them dense before enforcing uniqueness.
+        """
+        UPDATE questions SET position = (
+            SELECT COUNT(*) FROM questions AS q
+            WHERE q.position < questions.position
+               OR (q.position = questions.position AND q.id <= questions.id)
+        )
+        """,
+        'CREATE UNIQUE INDEX IF NOT EXISTS "idx_questions_position" ON "questions" ("position")',
+        'CREATE INDEX IF NOT EXISTS "idx_answers_question_id" ON "answers" ("question_id")',
+        'CREATE INDEX IF NOT EXISTS "idx_participations_score" ON "participations" ("score")',
+    ]),
+    (3, [
+        'ALTER TABLE "questions" ADD COLUMN "image_hash" TEXT',
+        'ALTER TABLE "questions" ADD COLUMN "image_updated_at" TEXT',
+        _normalize_question_images,
+    ]),
+    (4, [
+        'CREATE INDEX IF NOT EXISTS "idx_participations_player_name" ON "participations" ("player_name", "score")',
+    ]),
+    (5, [
+        # Image variants, shared by the questions with the same image hash
+        """
+        CREATE TABLE IF NOT EXISTS "images" (
+            "hash" TEXT NOT NULL,
+            "variant" TEXT NOT NULL,
+            "mime_type" TEXT NOT NULL,
+            "width" INTEGER,
+            "height" INTEGER,
+            "data" BLOB NOT NULL,
+            "created_at" TEXT NOT NULL,
+            PRIMARY KEY ("hash", "variant")
+        ) WITHOUT ROWID
+        """,
+        _move_question_images,
+    ]),
+    (6, [
+        """
+        CREATE TABLE IF NOT EXISTS "image_files" (
+            "hash" TEXT NOT NULL,
+            "variant" TEXT NOT NULL,
+            "mime_type" TEXT NOT NULL,
+            "width" INTEGER,
+            "height" INTEGER,
+            "size" INTEGER NOT NULL,
+            "file" TEXT NOT NULL,
+            "created_at" TEXT NOT NULL,
+            PRIMARY KEY ("hash", "variant")
+        ) WITHOUT ROWID
+        """,
+        _move_images_to_files,
+        'DROP TABLE "images"',
+        'ALTER TABLE "image_files" RENAME TO "images"',
+        'CREATE INDEX IF NOT EXISTS "idx_images_file" ON "images" ("file")',
+        'ALTER TABLE "questions" DROP COLUMN "image"',
+        # Give the pages of the moved BLOBs back to the file system
+        VACUUM,
+    ]),
+    (7, [
+        # Question ids of a quiz version, little-endian uint32 in position order
+        """
+        CREATE TABLE IF NOT EXISTS "answer_layouts" (
+            "id" INTEGER PRIMARY KEY,
+            "question_ids" BLOB NOT NULL UNIQUE
+        )
+        """,
+        # Points of each answer of a participation, one or two bytes each, in
+        # the order of its layout. NULL for the participations before.
+        'ALTER TABLE "participations" ADD COLUMN "layout_id" INTEGER',
+        'ALTER TABLE "participations" ADD COLUMN "points" BLOB',
+        """
+        CREATE TABLE IF NOT EXISTS "stats_scores" (
+            "score" INTEGER PRIMARY KEY,
+            "count" INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "stats_activity" (
+            "hour" TEXT PRIMARY KEY,
+            "count" INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "stats_questions" (
+            "question_id" INTEGER PRIMARY KEY,
+            "answered" INTEGER NOT NULL,
+            "correct" INTEGER NOT NULL,
+            "points" INTEGER NOT NULL
+        )
+        """,
+        # Last participation counted in the tables above. Earlier
+        # participations have no answers: the first checkpoint counts their
+        # scores and dates.
+        """
+        CREATE TABLE IF NOT EXISTS "stats_checkpoint" (
+            "id" INTEGER PRIMARY KEY CHECK ("id" = 1),
+            "through_id" INTEGER NOT NULL
+        )
+        """,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(cur):
+    cur.execute("PRAGMA user_version")
+    return cur.fetchone()[0]
+
+
+def run_migrations():
+    """
+    Brings the database schema up to SCHEMA_VERSION, one transaction per
+    migration. Safe to call on every startup.
+    :return: the schema version before migrating
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        initial_version = get_schema_version(cur)
+
+        for version, steps in MIGRATIONS:
+            if version <= initial_version:
+                continue
+
+            # Re-read the version inside the write lock, another process may
+            # have migrated in the meantime
+            cur.execute("BEGIN IMMEDIATE")
+            if get_schema_version(cur) >= version:
+                cur.execute("COMMIT")
+                continue
+
+            written = []
+            try:
+                for step in steps:
+                    if callable(step):
+                        written += step(cur) or []
+                    elif step != VACUUM:
+                        cur.execute(step)
+                cur.execute(f"PRAGMA user_version = {version}")
+                cur.execute("COMMIT")
+            except Exception as e:
+                # Before the rollback, while the write lock is still held
+                discard_image_files(written)
+                cur.execute("ROLLBACK")
+                raise e
+
+            if VACUUM in steps:
+                cur.execute(VACUUM)
+                cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                cur.fetchall()
+
+        return initial_version
+
+    finally:
+        release_db_connection(conn)
+
+
+# Each quiz database is brought up to date when it is opened
+databases.on_open(run_migrations)
@@ -0,0 +1,264 @@
+import logging
+import os
+import queue
+import threading
+import time
+from services.db_service import current_database, get_db_connection, release_db_connection, use_database
+from services import stats_service
+
+# Write-behind for participations, off unless QUIZ_WRITE_BEHIND=1
+WRITE_BEHIND = os.environ.get("QUIZ_WRITE_BEHIND") == "1"
+BATCH_SIZE = int(os.environ.get("QUIZ_WRITE_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.environ.get("QUIZ_WRITE_FLUSH_MS", "50")) / 1000
+# Backoff between attempts to commit a failing batch, doubled up to the max
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+# Attempts left to a failing batch once the writer is closing
+CLOSE_ATTEMPTS = 5
+
+_STOP = object()
+_FLUSH = object()
+
+logger = logging.getLogger(__name__)
+
+
+class ParticipationWriteError(RuntimeError):
+    """Queued participations could not be committed."""
+
+
+class ParticipationWriter:
+    """
+    Queues participation rows and commits them in batches from a background
+    thread: one transaction (and one fsync) per batch instead of per player.
+    A row waits at most flush_interval before its batch is committed. A
+    batch that fails to commit is retried with backoff, never dropped: its
+    rows were acknowledged already. One per quiz database, closed (and
+    flushed) with it.
+    """
+
+    def __init__(self, database, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, on_commit=None):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_commit = on_commit
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # Signaled when a batch commits or fails
+        self._committed = threading.Condition(self._lock)
+        self._thread = None
+        self._next_id = None
+        self._closing = False
+        # Rows submitted and not committed yet
+        self._pending = 0
+        # Last commit failure, cleared by the next commit
+        self.error = None
+        self.batches = 0
+        self.rows = 0
+        self.failures = 0
+
+    def submit(self, player_name, score, date, question_ids=None, points=None):
+        """
+        Queues a participation and its answers, and returns the id it will be
+        stored with.
+        """
+        with self._lock:
+            if self._next_id is None:
+                with use_database(self.database):
+                    self._next_id = _load_next_participation_id()
+            participation_id = self._next_id
+            self._next_id += 1
+
+            if self._thread is None:
+                self._closing = False
+                self._thread = threading.Thread(target=self._run, name=f"participation-writer-{self.database.id}",
+                                                daemon=True)
+                self._thread.start()
+
+            self._pending += 1
+            self._queue.put((participation_id, player_name, score, date, question_ids, points))
+
+        return participation_id
+
+    def reserve_ids(self, count):
+        """
+        Reserves ids for participations stored by someone else, e.g. an
+        import, so that queued ones never collide with them.
+        :return: the first of count consecutive ids
+        """
+        with self._lock:
+            if self._next_id is None:
+                with use_database(self.database):
+                    self._next_id = _load_next_participation_id()
+            first_id = self._next_id
+            self._next_id += count
+            return first_id
+
+    def flush(self):
+        """
+        Blocks until every queued participation is committed. The batch being
+        collected is committed right away, without waiting for its interval.
+        :raises ParticipationWriteError: when a batch fails to commit; its
+        rows stay queued and are retried
+        """
+        with self._committed:
+            if not self._pending:
+                return
+            self._queue.put(_FLUSH)
+            while self._pending:
+                if self.error is not None:
+                    raise ParticipationWriteError(
+                        f"{self._pending} queued participations are not committed: {self.error}") from self.error
+                self._committed.wait()
+
+    def reset_ids(self):
+        """
+        Flushes, then re-reads the next id from the database (after a rebuild).
+        """
+        self.flush()
+        with self._lock:
+            self._next_id = None
+
+    def close(self):
+        """
+        Commits the queued participations and stops the writer.
+        :raises ParticipationWriteError: when some could not be committed;
+        they are logged
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._closing = True
+            self._queue.put(_STOP)
+        thread.join()
+        with self._lock:
+            lost, self._pending = self._pending, 0
+            error, self.error = self.error, None
+        if lost:
+            raise ParticipationWriteError(f"{lost} participations were not committed: {error}") from error
+
+    def _run(self):
+        with use_database(self.database):
+            self._write_batches()
+
+    def _write_batches(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if item is _FLUSH:
+                continue
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+    def _write(self, batch):
+        delay = RETRY_DELAY
+        attempts = 0
+        while True:
+            try:
+                self._commit(batch)
+                break
+            except Exception as e:
+                attempts += 1
+                with self._committed:
+                    self.error = e
+                    self.failures += 1
+                    closing = self._closing
+                    self._committed.notify_all()
+                if closing and attempts >= CLOSE_ATTEMPTS:
+                    # Nothing is left to retry them: close() reports them
+                    logger.error("Could not commit participations: %s", batch)
+                    return
+                logger.warning("Error writing %d participations (attempt %d), retrying in %.1f s: %s",
+                               len(batch), attempts, delay, e)
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+        with self._committed:
+            self.error = None
+            self._pending -= len(batch)
+            self.batches += 1
+            self.rows += len(batch)
+            self._committed.notify_all()
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def _commit(self, batch):
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            rows = [(*item[:4], *stats_service.answer_columns(*item[4:])) for item in batch]
+            cur.execute("BEGIN IMMEDIATE")
+            cur.executemany("""
+                INSERT INTO participations (id, player_name, score, date, layout_id, points)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            cur.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                cur.execute("ROLLBACK")
+            raise
+        finally:
+            release_db_connection(conn)
+
+
+def _load_next_participation_id():
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        # sqlite_sequence keeps AUTOINCREMENT from reusing deleted ids
+        cur.execute("""
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'participations'), 0),
+                COALESCE((SELECT MAX(id) FROM participations), 0)
+            )
+        """)
+        return cur.fetchone()[0] + 1
+    finally:
+        release_db_connection(conn)
+
+
+def get_participation_writer(on_commit=None):
+    """
+    :param on_commit: called after each batch commit, given when the writer
+    of the current quiz is created
+    :return: the write-behind queue of the current quiz, None when write-behind is off
+    """
+    if not WRITE_BEHIND:
+        return None
+    database = current_database()
+    return database.attach("participation_writer", lambda: ParticipationWriter(database, on_commit=on_commit))
+
+
+def flush_participations():
+    writer = current_database().attached("participation_writer")
+    if writer is not None:
+        writer.flush()
+
+
+def reset_participation_ids():
+    """
+    Flushes, then lets the writer of the current quiz re-read the next id
+    from the database (after a rebuild).
+    """
+    writer = current_database().attached("participation_writer")
+    if writer is not None:
+        writer.reset_ids()
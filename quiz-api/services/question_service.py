@@ -1,42 +1,93 @@
 import sqlite3
-from models.question_model import Question, question_from_json
+from models.question_model import Question, question_from_json, question_to_json, question_to_player_json
 from models.answer_model import Answer
+from services.cache_service import QuizCache, QuizSnapshot, VersionCounter
+from services.db_service import current_database, databases, get_db_connection, release_db_connection
+from services.json_service import dumps
+from services.geo_service import band_points, nearest_distances_km, valid_coordinates
+from services.rank_service import get_score_ranking
+from services.stats_service import answer_columns, delete_stats, get_quiz_stats
+from services.participation_writer import get_participation_writer, flush_participations
+from services.metrics_service import register_collector, timed
+from services.compression_service import encode_payload
+from services.image_service import VARIANT_NAMES, encode_images, missing_images, store_images, delete_unused_images, image_file_path, discard_image_files, remove_image_files
 from datetime import datetime, timezone 
 
-DB_PATH = 'quiz-db.db'
+def _shift_positions(cur, delta, start, end=None, keep_id=None):
+    # Moves every question with start <= position <= end (no upper bound when
+    # end is None) by delta, with two range UPDATEs whatever the number of
+    # rows. Rows first go through negative positions so the unique index on
+    # position never sees a duplicate mid-statement. The question keep_id, if
+    # given, is left at its negated position for the caller to place.
+    if end is None:
+        cur.execute("UPDATE questions SET position = -position WHERE position >= ?", (start,))
+        cur.execute("""
+            UPDATE questions SET position = -position + ?
+            WHERE position <= ? AND id IS NOT ?
+        """, (delta, -start, keep_id))
+    else:
+        cur.execute("UPDATE questions SET position = -position WHERE position BETWEEN ? AND ?", (start, end))
+        cur.execute("""
+            UPDATE questions SET position = -position + ?
+            WHERE position BETWEEN ? AND ? AND id IS NOT ?
+        """, (delta, -end, -start, keep_id))
+
+def _check_position(position):
+    # Positions are dense, 1..N: anything else would be corrupted by the
+    # negative parking of _shift_positions()
+    if isinstance(position, bool) or not isinstance(position, int) or position < 1:
+        raise ValueError("Position must be an integer >= 1")
+
+def _encode_new_image(question):
+    """
+    Encodes the variants of an uploaded image, before the write transaction
+    and unless the image store already has it.
+    :return: dict of image hash -> variants, for _store_question_image()
+    """
+    if not question.image:
+        return {}
+
+    conn = get_db_connection()
+    try:
+        if not missing_images(conn.cursor(), [question.image_hash]):
+            return {}
+    finally:
+        release_db_connection(conn)
+    return {question.image_hash: encode_images([question.image])[0]}
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.isolation_level = None 
-    return conn
+def _store_question_image(cur, question, encoded):
+    # The image may have been removed since _encode_new_image() checked
+    if question.image and not encoded and missing_images(cur, [question.image_hash]):
+        encoded = {question.image_hash: encode_images([question.image])[0]}
+    return store_images(cur, encoded)
 
+@timed
 def create_question(json_data):
     question = question_from_json(json_data)
+    _check_position(question.position)
+    encoded = _encode_new_image(question)
     conn = get_db_connection()
     cur = conn.cursor()
+    written = []
 
     try:
         cur.execute("BEGIN")
-        # Check if position already occupied
-        cur.execute("SELECT COUNT(*) FROM questions WHERE position = ?", (question.position,))
+        # Past the end means last: positions stay dense
+        cur.execute("SELECT COUNT(*) FROM questions")
         (count,) = cur.fetchone()
+        question.position = min(question.position, count + 1)
 
-        if count > 0:
+        if question.position <= count:
             # Shift down
-            cur.execute("""
-                SELECT id, position FROM questions
-                WHERE position >= ?
-                ORDER BY position DESC
-            """, (question.position,))
-            rows = cur.fetchall()
-            for row_id, pos in rows:
-                cur.execute("UPDATE questions SET position = ? WHERE id = ?", (pos + 1, row_id))
-
-        # Insert new question
+            _shift_positions(cur, 1, question.position)
+
+        # Insert new question; the image store keeps its image
+        written = _store_question_image(cur, question, encoded)
         cur.execute("""
-            INSERT INTO questions (title, position, text, image)
-            VALUES (?, ?, ?, ?)
-        """, (question.title, question.position, question.text, question.image))
+            INSERT INTO questions (title, position, text, image_hash, image_updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (question.title, question.position, question.text,
+              question.image_hash, datetime.now(timezone.utc).isoformat()))
 
         question_id = cur.lastrowid
 
@@ -53,19 +104,26 @@ def create_question(json_data):
             ))
 
         cur.execute("COMMIT")
+        _quiz_cache().invalidate()
         return question_id
 
     except Exception as e:
+        discard_image_files(written)
         cur.execute("ROLLBACK")
         raise e
 
     finally:
-        conn.close()
+        release_db_connection(conn)
 
+@timed
 def update_question_by_id(question_id, json_data):
-    question = question_from_json(json_data)
+    question = question_from_json(json_data, question_id, current_database().url_prefix)
+    _check_position(question.position)
+    encoded = _encode_new_image(question)
     conn = get_db_connection()
     cur = conn.cursor()
+    written = []
+    unused = []
 
     try:
         cur.execute("BEGIN")
@@ -78,36 +136,36 @@ def update_question_by_id(question_id, json_data):
             return False  
 
         old_position = row[0]
-        new_position = question.position
+        # Past the end means last
+        cur.execute("SELECT COUNT(*) FROM questions")
+        new_position = min(question.position, cur.fetchone()[0])
 
         if new_position < old_position:
             # Shift down
-            cur.execute("""
-                SELECT id, position FROM questions
-                WHERE position >= ? AND position < ?
-                ORDER BY position DESC
-            """, (new_position, old_position))
-            rows = cur.fetchall()
-            for row_id, pos in rows:
-                cur.execute("UPDATE questions SET position = ? WHERE id = ?", (pos + 1, row_id))
+            _shift_positions(cur, 1, new_position, old_position, keep_id=question_id)
 
         elif new_position > old_position:
             # Shift up
-            cur.execute("""
-                SELECT id, position FROM questions
-                WHERE position <= ? AND position > ?
-                ORDER BY position ASC
-            """, (new_position, old_position))
-            rows = cur.fetchall()
-            for row_id, pos in rows:
-                cur.execute("UPDATE questions SET position = ? WHERE id = ?", (pos - 1, row_id))
+            _shift_positions(cur, -1, old_position, new_position, keep_id=question_id)
 
         # Update the question itself
         cur.execute("""
             UPDATE questions
-            SET title = ?, position = ?, text = ?, image = ?
+            SET title = ?, position = ?, text = ?
             WHERE id = ?
-        """, (question.title, new_position, question.text, question.image, question_id))
+        """, (question.title, new_position, question.text, question_id))
+
+        # A None image means the client kept the current one
+        if question.image is not None:
+            written = _store_question_image(cur, question, encoded)
+            cur.execute("""
+                UPDATE questions
+                SET image_hash = ?, image_updated_at = ?
+                WHERE id = ? AND image_hash IS NOT ?
+            """, (question.image_hash, datetime.now(timezone.utc).isoformat(),
+                  question_id, question.image_hash))
+            if cur.rowcount:
+                unused = delete_unused_images(cur)
 
         # Replace answers
         cur.execute("DELETE FROM answers WHERE question_id = ?", (question_id,))
@@ -124,143 +182,193 @@ def update_question_by_id(question_id, json_data):
             ))
 
         cur.execute("COMMIT")
-        return True
+        _quiz_cache().invalidate()
 
     except Exception as e:
+        discard_image_files(written)
         cur.execute("ROLLBACK")
         raise e
 
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+    remove_image_files(unused)
+    return True
 
 def get_question_by_id_from_db(question_id: int) -> Question:
+    return _quiz_cache().get().by_id.get(question_id)
+
+def get_question_by_position(position: int) -> Question:
+    return _quiz_cache().get().by_position.get(position)
+
+def _encoded_payload(snapshot, key, build, encoding):
+    # Compressed forms live in the bounded payload cache, keyed by version
+    return encode_payload((snapshot.version, key), snapshot.payload(key, build), encoding)
+
+def get_all_questions_json(encoding=None):
+    """
+    :return: (body, encoding) of the JSON list, compressed when encoding is set
+    """
+    snapshot = _quiz_cache().get()
+    return _encoded_payload(snapshot, "all", lambda: dumps([question_to_json(q) for q in snapshot.questions]),
+                            encoding)
+
+def get_question_json_by_position(position: int, encoding=None):
+    snapshot = _quiz_cache().get()
+    question = snapshot.by_position.get(position)
+    if question is None:
+        return None
+    return _encoded_payload(snapshot, ("position", position), lambda: dumps(question_to_json(question)), encoding)
+
+def get_question_json_by_id(question_id: int, encoding=None):
+    snapshot = _quiz_cache().get()
+    question = snapshot.by_id.get(question_id)
+    if question is None:
+        return None
+    return _encoded_payload(snapshot, ("id", question_id), lambda: dumps(question_to_json(question)), encoding)
+
+def get_quiz_bundle_json(start=1, count=None, encoding=None):
+    """
+    The playable quiz from its `start`-th question (1-based, in position
+    order, whatever gaps the positions have), `count` questions at most
+    (all when None), without correctness flags. Each question is encoded once
+    per version, and so is each compressed window.
+    :return: (body, encoding), as get_all_questions_json()
+    """
+    snapshot = _quiz_cache().get()
+    size = len(snapshot.questions)
+    end = size if count is None else min(size, start + count - 1)
+
+    def build():
+        fragments = []
+        for question in snapshot.questions[start - 1:end]:
+            fragments.append(snapshot.payload(("player", question.id),
+                                              lambda: dumps(question_to_player_json(question))))
+        header = dumps({"version": snapshot.version, "size": size, "from": start})
+        return header[:-1] + b',"questions":[' + b','.join(fragments) + b']}'
+
+    if start == 1 and end == size:
+        return _encoded_payload(snapshot, "bundle", build, encoding)
+    # Windows are joined from the cached fragments, their compressed form is cached
+    return encode_payload((snapshot.version, "bundle", start, end), build(), encoding)
+
+def get_question_image(question_id: int, variant="full"):
+    """
+    :return: (file path, mime_type, image_hash, image_updated_at) of the
+    variant, or of the next larger one stored, None when the question has no image
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    cur = conn.cursor()
 
     try:
-        cursor.execute("BEGIN")
-        cursor.execute("SELECT title, position, text, image FROM questions WHERE id = ?", (question_id,))
-        row = cursor.fetchone()
-
-        if not row:
-            cursor.execute("COMMIT")
+        cur.execute("SELECT image_hash, image_updated_at FROM questions WHERE id = ? AND image_hash IS NOT NULL",
+                    (question_id,))
+        row = cur.fetchone()
+        if row is None:
             return None
 
-        title, position, text, image = row
-
-        cursor.execute("""
-            SELECT text, is_correct, latitude, longitude
-            FROM answers
-            WHERE question_id = ?
-        """, (question_id,))
-        answers_rows = cursor.fetchall()
-
-        answers = [
-            Answer(
-                text=ans[0],
-                is_correct=bool(ans[1]),
-                latitude=ans[2],
-                longitude=ans[3]
-            )
-            for ans in answers_rows
-        ]
-
-        cursor.execute("COMMIT")
-        return Question(
-            title=title,
-            position=position,
-            text=text,
-            image_bytes=image,
-            possible_answers=answers,
-            question_id=question_id
-        )
-
-    except Exception as e:
-        cursor.execute("ROLLBACK")
-        raise e
+        for name in VARIANT_NAMES[VARIANT_NAMES.index(variant):]:
+            cur.execute("SELECT file, mime_type FROM images WHERE hash = ? AND variant = ?", (row[0], name))
+            image = cur.fetchone()
+            if image is not None:
+                return image_file_path(image[0]), image[1], row[0], row[1]
+        return None
 
     finally:
-        conn.close()
-
-def get_question_by_position(position: int) -> Question:
+        release_db_connection(conn)
+
+def _participation_to_json(row):
+    return {
+        "id": row["id"],
+        "playerName": row["player_name"],
+        "score": row["score"],
+        "date": row["date"]
+    }
+
+@timed
+def get_quiz_info_handler(limit=None, offset=0, after=None, player_name=None):
+    """
+    Leaderboard, best scores first (ties: most recent first).
+    :param limit: page size, None for every participation
+    :param offset: rows to skip
+    :param after: (score, id) keyset cursor of the last row already seen
+    :param player_name: also return the rank of this player's best score
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
 
     try:
-        cursor.execute("BEGIN")
-        cursor.execute("SELECT id, title, position, text, image FROM questions WHERE position = ?", (position,))
-        row = cursor.fetchone()
+        query = "SELECT id, player_name, score, date FROM participations"
+        params = []
 
-        if not row:
-            cursor.execute("COMMIT")
-            return None
+        if after is not None:
+            query += " WHERE (score, id) < (?, ?)"
+            params += after
 
-        question_id, title, position, text, image = row
-
-        cursor.execute("""
-            SELECT text, is_correct, latitude, longitude
-            FROM answers
-            WHERE question_id = ?
-        """, (question_id,))
-        answers_rows = cursor.fetchall()
-
-        answers = [
-            Answer(
-                text=ans[0],
-                is_correct=bool(ans[1]),
-                latitude=ans[2],
-                longitude=ans[3]
-            )
-            for ans in answers_rows
-        ]
+        query += " ORDER BY score DESC, id DESC"
 
-        cursor.execute("COMMIT")
-        return Question(
-            title=title,
-            position=position,
-            text=text,
-            image_bytes=image,
-            possible_answers=answers,
-            question_id=question_id
-        )
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
 
-    except Exception as e:
-        cursor.execute("ROLLBACK")
-        raise e
+        cur.execute(query, params)
+        participations = [_participation_to_json(row) for row in cur.fetchall()]
 
-    finally:
-        conn.close()
+        result = {
+            "scores": participations,
+            # Served from the quiz snapshot, no COUNT(*) per request
+            "size": len(_quiz_cache().get().questions)
+        }
 
-def get_quiz_info_handler():
+        if limit and len(participations) == limit:
+            last = participations[-1]
+            result["nextCursor"] = f"{last['score']}:{last['id']}"
+
+        if player_name is not None:
+            result["player"] = _get_player_rank(cur, player_name)
+
+        return result
+
+    finally:
+        release_db_connection(conn)
+
+def _get_player_rank(cur, player_name):
+    cur.execute("SELECT MAX(score) AS score FROM participations WHERE player_name = ?", (player_name,))
+    best_score = cur.fetchone()["score"]
+
+    if best_score is None:
+        return {"playerName": player_name, "score": None, "rank": None, "total": get_score_ranking().total()}
+
+    rank, percentile, total = get_score_ranking().rank(best_score)
+    return {
+        "playerName": player_name,
+        "score": best_score,
+        "rank": rank,
+        "percentile": percentile,
+        "total": total
+    }
+
+def iter_participations(batch_size=500):
+    # Generator for streamed exports: rows are fetched in batches, so memory
+    # stays flat whatever the number of participations.
     conn = get_db_connection()
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
 
     try:
-        # Get all participations
-        cur.execute("SELECT id, player_name, score, date FROM participations ORDER BY score DESC")
-        participations = [
-            {
-                "id": row["id"],
-                "playerName": row["player_name"],
-                "score": row["score"],
-                "date": row["date"]
-            }
-            for row in cur.fetchall()
-        ]
-
-        # Count questions
-        cur.execute("SELECT COUNT(*) as count FROM questions")
-        size = cur.fetchone()["count"]
-
-        return {
-            "scores": participations,
-            "size": size
-        }
+        cur.execute("SELECT id, player_name, score, date FROM participations ORDER BY score DESC, id DESC")
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield _participation_to_json(row)
 
     finally:
-        conn.close()
+        release_db_connection(conn)
 
+@timed
 def delete_question_by_position(position: int):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -277,23 +385,24 @@ def delete_question_by_position(position: int):
 
         cur.execute("DELETE FROM answers WHERE question_id = ?", (question_id,))
         cur.execute("DELETE FROM questions WHERE id = ?", (question_id,))
+        unused = delete_unused_images(cur)
 
-        cur.execute("""
-            UPDATE questions
-            SET position = position - 1
-            WHERE position > ?
-        """, (position,))
+        _shift_positions(cur, -1, position + 1)
 
         cur.execute("COMMIT")
-        return True
+        _quiz_cache().invalidate()
 
     except Exception as e:
         cur.execute("ROLLBACK")
         raise e
 
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+    remove_image_files(unused)
+    return True
 
+@timed
 def delete_question_by_id(question_id: int):
     conn = get_db_connection()
     cur = conn.cursor()
@@ -310,14 +419,44 @@ def delete_question_by_id(question_id: int):
 
         cur.execute("DELETE FROM answers WHERE question_id = ?", (question_id,))
         cur.execute("DELETE FROM questions WHERE id = ?", (question_id,))
+        unused = delete_unused_images(cur)
 
-        cur.execute("""
-            UPDATE questions
-            SET position = position - 1
-            WHERE position > ?
-        """, (position,))
+        _shift_positions(cur, -1, position + 1)
 
         cur.execute("COMMIT")
+        _quiz_cache().invalidate()
+
+    except Exception as e:
+        cur.execute("ROLLBACK")
+        raise e
+
+    finally:
+        release_db_connection(conn)
+
+    remove_image_files(unused)
+    return True
+
+@timed
+def reorder_questions(question_ids):
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+
+        cur.execute("SELECT id FROM questions")
+        existing_ids = {row[0] for row in cur.fetchall()}
+
+        if len(question_ids) != len(existing_ids) or set(question_ids) != existing_ids:
+            raise ValueError("Order must list every question id exactly once")
+
+        cur.execute("UPDATE questions SET position = -position")
+        cur.executemany(
+            "UPDATE questions SET position = ? WHERE id = ?",
+            [(position, question_id) for position, question_id in enumerate(question_ids, start=1)]
+        )
+
+        cur.execute("COMMIT")
+        _quiz_cache().invalidate()
         return True
 
     except Exception as e:
@@ -325,8 +464,9 @@ def delete_question_by_id(question_id: int):
         raise e
 
     finally:
-        conn.close()
+        release_db_connection(conn)
 
+@timed
 def delete_all_questions():
     conn = get_db_connection()
     cur = conn.cursor()
@@ -335,139 +475,323 @@ def delete_all_questions():
 
         cur.execute("DELETE FROM answers")
         cur.execute("DELETE FROM questions")
+        unused = delete_unused_images(cur)
 
         cur.execute("COMMIT")
-        return True
+        _quiz_cache().invalidate()
 
     except Exception as e:
         cur.execute("ROLLBACK")
         raise e
 
     finally:
-        conn.close()
+        release_db_connection(conn)
 
+    remove_image_files(unused)
+    return True
+
+@timed
 def delete_all_participations():
     conn = get_db_connection()
     cur = conn.cursor()
     try:
+        flush_participations()
+        # One transaction: a checkpoint never sees the stats gone but not the rows
+        cur.execute("BEGIN IMMEDIATE")
+        delete_stats(cur)
         cur.execute("DELETE FROM participations")
         conn.commit()
+        get_score_ranking().reset()
+        get_quiz_stats().reset()
+        bump_participations_version()
     except Exception as e:
         conn.rollback()
         raise e
     finally:
-        conn.close()
-
-def create_participation_handler(player_name, submitted_answers):
-    conn = get_db_connection()
-    cur = conn.cursor()
-
+        release_db_connection(conn)
+
+def load_answer_key(cursor):
+    # One set-based read of the whole quiz: position -> correctness flags of
+    # its answers, in the same order the players see them (answer id order).
+    cursor.execute("""
+        SELECT q.position, a.is_correct
+        FROM questions q
+        LEFT JOIN answers a ON a.question_id = q.id
+        ORDER BY q.position ASC, a.id ASC
+    """)
+
+    answer_key = {}
+    for position, is_correct in cursor:
+        flags = answer_key.setdefault(position, [])
+        if is_correct is not None:
+            flags.append(is_correct == 1)
+
+    return answer_key
+
+def _map_click(position, submitted_answer, geo_key):
+    """
+    :return: (clicked point, index of the correct answer locations) of a map answer
+    """
+    target = (geo_key or {}).get(position)
+    if target is None:
+        raise ValueError("No map answer for question at position {}".format(position))
     try:
-        # Get quiz size
-        cur.execute("SELECT COUNT(*) FROM questions")
-        (quiz_size,) = cur.fetchone()
-
+        point = (float(submitted_answer['latitude']), float(submitted_answer['longitude']))
+    except (KeyError, TypeError, ValueError):
+        point = None
+    if point is None or not valid_coordinates(*point):
+        raise ValueError("Invalid coordinates for question at position {}".format(position))
+    return point, target
+
+def score_answer(answer_key, position, submitted_answer, geo_key=None):
+    """
+    :return: points of a single answer: an answer index, or a map click
+    """
+    if isinstance(submitted_answer, dict):
+        point, target = _map_click(position, submitted_answer, geo_key)
+        return band_points(nearest_distances_km([point], [target]))
+
+    flags = answer_key.get(position, ())
+    idx = submitted_answer - 1 if isinstance(submitted_answer, int) else -1
+    if 0 <= idx < len(flags):
+        return 1 if flags[idx] else 0
+    raise ValueError("Invalid answer index for question at position {}".format(position))
+
+def score_submissions(answer_key, submissions, geo_key=None):
+    """
+    :return: the points of each answer of each submission, in position order.
+    The map clicks of every submission are measured in one distance pass.
+    """
+    results = []
+    clicks = []
+    click_points = []
+    click_targets = []
+
+    for submitted_answers in submissions:
         # Validate answers length
-        if len(submitted_answers) != quiz_size:
+        if len(submitted_answers) != len(answer_key):
             raise ValueError("Invalid number of submitted answers")
 
-        score = 0
-
-        # Calculate score
+        points = [0] * len(submitted_answers)
         for position, submitted_answer_index in enumerate(submitted_answers, start=1):
+            if isinstance(submitted_answer_index, dict):
+                # Map click: scored below by distance to the correct answer
+                point, target = _map_click(position, submitted_answer_index, geo_key)
+                clicks.append((points, position - 1))
+                click_points.append(point)
+                click_targets.append(target)
+                continue
+
+            points[position - 1] = score_answer(answer_key, position, submitted_answer_index)
+        results.append(points)
+
+    if clicks:
+        for (points, offset), distance in zip(clicks, nearest_distances_km(click_points, click_targets)):
+            points[offset] = band_points([distance])
+
+    return results
+
+def answer_points(answer_key, submitted_answers, geo_key=None):
+    """
+    :return: the points of each submitted answer, in position order
+    """
+    return score_submissions(answer_key, [submitted_answers], geo_key)[0]
+
+def score_answers(answer_key, submitted_answers, geo_key=None):
+    return sum(answer_points(answer_key, submitted_answers, geo_key))
+
+def find_nearest_answer(latitude, longitude):
+    """
+    :return: (question, answer, distance_km) of the answer location closest
+    to a point, or None when no answer has coordinates
+    """
+    found = _quiz_cache().get().geo_index.nearest(latitude, longitude)
+    if found is None:
+        return None
+    (question, answer), distance = found
+    return question, answer, distance
+
+@timed
+def create_participation_handler(player_name, submitted_answers):
+    snapshot = _quiz_cache().get()
+    points = answer_points(snapshot.answer_key, submitted_answers, snapshot.geo_key)
+    return record_participation(player_name, sum(points), snapshot.question_ids, points)
+
+def record_participation(player_name, score, question_ids=None, points=None):
+    """
+    Stores an already computed score, with the points of each answer for the stats.
+    :param question_ids: ids of the questions answered, in position order
+    :param points: points of each answer, in the same order
+    :return: the participation with its rank, percentile and total
+    """
+    current_date = datetime.now(timezone.utc).isoformat()
+
+    participation_writer = get_participation_writer(on_commit=bump_participations_version)
+    if participation_writer is not None:
+        # Scored synchronously, stored by the next batch commit
+        participation_id = participation_writer.submit(player_name, score, current_date, question_ids, points)
+    else:
+        layout_id, answer_points = answer_columns(question_ids, points)
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        try:
             cur.execute("""
-                SELECT a.id, a.is_correct
-                FROM answers a
-                JOIN questions q ON a.question_id = q.id
-                WHERE q.position = ?
-                ORDER BY a.id ASC
-            """, (position,))
-            answers_for_question = cur.fetchall()
-
-            idx = submitted_answer_index - 1  
-
-            if 0 <= idx < len(answers_for_question):
-                answer,is_correct = answers_for_question[idx]
-                if is_correct == 1:
-                    score += 1
-            else:
-                raise ValueError("Invalid answer index for question at position {}".format(position))
-
-        current_date = datetime.now(timezone.utc).isoformat()
-
-        cur.execute("""
-            INSERT INTO participations (player_name, score, date)
-            VALUES (?, ?, ?)
-        """, (player_name, score, current_date))
+                INSERT INTO participations (player_name, score, date, layout_id, points)
+                VALUES (?, ?, ?, ?, ?)
+            """, (player_name, score, current_date, layout_id, answer_points))
+
+            participation_id = cur.lastrowid
+
+            conn.commit()
+
+        except Exception as e:
+            conn.rollback()
+            raise e
+
+        finally:
+            release_db_connection(conn)
+
+    get_quiz_stats().add(participation_id, score, current_date, question_ids, points)
+    score_ranking = get_score_ranking()
+    score_ranking.add(score, participation_id)
+    if participation_writer is None:
+        # Last: a read that sees the new version must also see the new row
+        # in the ranking and stats (the queue bumps it after each batch)
+        bump_participations_version()
+    rank, percentile, total = score_ranking.rank(score)
+
+    return {
+        "id": participation_id,
+        "playerName": player_name,
+        "score": score,
+        "date": current_date,
+        "rank": rank,
+        "percentile": percentile,
+        "total": total
+    }
 
-        participation_id = cur.lastrowid
+def get_all_questions() -> list[Question]:
+    return list(_quiz_cache().get().questions)
+
+def _load_questions(cursor) -> list[Question]:
+    # Batched loader: one query for the questions, one for all of their
+    # answers, grouped in a single pass (no per-question answer query).
+    # Image bytes stay in the database, they are served by get_question_image
+    url_prefix = current_database().url_prefix
+    cursor.execute("""
+        SELECT id, title, position, text, image_hash, image_updated_at
+        FROM questions
+        ORDER BY position ASC
+    """)
+
+    questions = []
+    questions_by_id = {}
+
+    for question_id, title, position, text, image_hash, image_updated_at in cursor.fetchall():
+        question = Question(
+            title=title,
+            position=position,
+            text=text,
+            image_bytes=None,
+            possible_answers=[],
+            question_id=question_id,
+            image_hash=image_hash,
+            image_updated_at=image_updated_at,
+            url_prefix=url_prefix
+        )
+        questions.append(question)
+        questions_by_id[question_id] = question
 
-        conn.commit()
+    if not questions:
+        return questions
 
-        return {
-            "id": participation_id,
-            "playerName": player_name,
-            "score": score,
-            "date": current_date
-        }
+    cursor.execute("""
+        SELECT question_id, text, is_correct, latitude, longitude
+        FROM answers
+        ORDER BY question_id ASC, id ASC
+    """)
 
-    except Exception as e:
-        conn.rollback()
-        raise e
+    for question_id, text, is_correct, latitude, longitude in cursor:
+        question = questions_by_id.get(question_id)
+        if question is not None:
+            question.possible_answers.append(Answer(
+                text=text,
+                is_correct=bool(is_correct),
+                latitude=latitude,
+                longitude=longitude
+            ))
 
-    finally:
-        conn.close()
+    return questions
 
-def get_all_questions() -> list[Question]:
+@timed
+def _load_quiz_snapshot(version) -> QuizSnapshot:
     conn = get_db_connection()
     cursor = conn.cursor()
 
     try:
         cursor.execute("BEGIN")
 
-        cursor.execute("SELECT id, title, position, text, image FROM questions ORDER BY position ASC")
-        rows = cursor.fetchall()
-
-        questions = []
-
-        for row in rows:
-            question_id, title, position, text, image = row
-
-            # Now includes latitude and longitude
-            cursor.execute("""
-                SELECT text, is_correct, latitude, longitude
-                FROM answers
-                WHERE question_id = ?
-            """, (question_id,))
-            answers_rows = cursor.fetchall()
-
-            # Updated to unpack and pass optional lat/lon
-            answers = [
-                Answer(
-                    text=ans[0],
-                    is_correct=bool(ans[1]),
-                    latitude=ans[2],
-                    longitude=ans[3]
-                )
-                for ans in answers_rows
-            ]
-
-            question = Question(
-                title=title,
-                position=position,
-                text=text,
-                image_bytes=image,
-                possible_answers=answers,
-                question_id=question_id
-            )
-            questions.append(question)
+        questions = _load_questions(cursor)
+        answer_key = load_answer_key(cursor)
 
         cursor.execute("COMMIT")
-        return questions
+        return QuizSnapshot(version, questions, answer_key)
 
     except Exception as e:
         cursor.execute("ROLLBACK")
         raise e
 
     finally:
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
+
+def _quiz_cache():
+    # Snapshot cache of the current quiz
+    return current_database().attach("quiz_cache", lambda: QuizCache(_load_quiz_snapshot))
+
+def get_quiz_snapshot() -> QuizSnapshot:
+    return _quiz_cache().get()
+
+def get_quiz_version():
+    return _quiz_cache().version
+
+def get_participations_version():
+    return current_database().attach("participations_version", VersionCounter).value
+
+def bump_participations_version():
+    current_database().attach("participations_version", VersionCounter).bump()
+
+def invalidate_quiz_cache():
+    _quiz_cache().invalidate()
+
+def get_quiz_cache_stats():
+    return _quiz_cache().stats()
+
+def _collect_metrics():
+    # Summed over the open quiz databases
+    caches = [cache for cache in (database.attached("quiz_cache") for database in databases) if cache is not None]
+    writers = [writer for writer in (database.attached("participation_writer") for database in databases)
+               if writer is not None]
+    stats = [cache.stats() for cache in caches]
+    metrics = [
+        ("quiz_cache_hits_total", "counter", "Quiz snapshot lookups served from memory.",
+         sum(stat["hits"] for stat in stats)),
+        ("quiz_cache_misses_total", "counter", "Quiz snapshot lookups that loaded the database.",
+         sum(stat["misses"] for stat in stats)),
+        ("quiz_cache_invalidations_total", "counter", "Quiz snapshot invalidations.",
+         sum(stat["invalidations"] for stat in stats)),
+        ("quiz_content_version", "gauge", "Latest quiz content version.",
+         max((stat["version"] for stat in stats), default=0)),
+    ]
+    if writers:
+        metrics += [
+            ("quiz_participation_batches_total", "counter", "Participation batches committed.",
+             sum(writer.batches for writer in writers)),
+            ("quiz_participation_rows_total", "counter", "Participations committed in batches.",
+             sum(writer.rows for writer in writers)),
+            ("quiz_participation_write_failures_total", "counter", "Participation batch commits that failed.",
+             sum(writer.failures for writer in writers)),
+        ]
+    return metrics
+
+register_collector(_collect_metrics)
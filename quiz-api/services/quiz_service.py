@@ -0,0 +1,204 @@
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+from services import db_service
+from services.session_service import session_store
+
+QUIZ_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+# An unknown quiz id reloads the catalog at most this often: requests for
+# ids that do not exist are answered from memory in between
+CATALOG_RELOAD_INTERVAL = float(os.environ.get("QUIZ_CATALOG_RELOAD_S", "2"))
+# How long deleting a quiz waits for its requests in flight
+DELETE_TIMEOUT = float(os.environ.get("QUIZ_DELETE_TIMEOUT_S", "5"))
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "quizzes" (
+    "id" TEXT PRIMARY KEY,
+    "title" TEXT NOT NULL,
+    "created_at" TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class QuizExists(ValueError):
+    """A quiz with this id already exists."""
+
+
+class QuizInUse(RuntimeError):
+    """The quiz still has requests in flight."""
+
+
+class QuizCatalog:
+    """
+    The quizzes served, in a small SQLite file of their own next to the quiz
+    databases. Read once and kept in memory: resolving the quiz of a request
+    never touches the disk, nor any quiz database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quizzes = None
+        self._loaded_at = 0.0
+        self._created = False
+
+    def _path(self):
+        return os.path.join(db_service.data_dir(), "catalog.db")
+
+    def _connect(self, read_only=False):
+        # Lock held by the caller. The schema and the default quiz are
+        # created once, by the first connection; reads are read-only after
+        if self._created and read_only:
+            conn = sqlite3.connect(f"file:{urllib.request.pathname2url(self._path())}?mode=ro", uri=True)
+        else:
+            os.makedirs(db_service.data_dir(), exist_ok=True)
+            conn = sqlite3.connect(self._path())
+        conn.execute("PRAGMA busy_timeout = 5000")
+        if not self._created:
+            conn.execute(CATALOG_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO quizzes (id, title, created_at) VALUES (?, ?, ?)",
+                         (db_service.DEFAULT_QUIZ, "Quiz", datetime.now(timezone.utc).isoformat()))
+            conn.commit()
+            self._created = True
+        return conn
+
+    def _load(self):
+        # Lock held by the caller
+        conn = self._connect(read_only=True)
+        try:
+            rows = conn.execute("SELECT id, title, created_at FROM quizzes ORDER BY created_at, id").fetchall()
+        finally:
+            conn.close()
+        self._quizzes = {quiz_id: _quiz_to_json(quiz_id, title, created_at) for quiz_id, title, created_at in rows}
+        self._loaded_at = time.monotonic()
+
+    def init(self):
+        """
+        Creates the catalog if needed and loads it, at startup.
+        """
+        with self._lock:
+            self._load()
+
+    def get(self, quiz_id):
+        quizzes = self._quizzes
+        if quizzes is not None and quiz_id in quizzes:
+            return quizzes[quiz_id]
+        if not QUIZ_ID_PATTERN.match(quiz_id):
+            return None
+        # Unknown here: it may have been created by another process since
+        # the last load, reloaded at most once per CATALOG_RELOAD_INTERVAL
+        if quizzes is not None and time.monotonic() - self._loaded_at < CATALOG_RELOAD_INTERVAL:
+            return None
+        with self._lock:
+            if self._quizzes is None or time.monotonic() - self._loaded_at >= CATALOG_RELOAD_INTERVAL:
+                self._load()
+            return self._quizzes.get(quiz_id)
+
+    def list(self):
+        with self._lock:
+            if self._quizzes is None:
+                self._load()
+            return list(self._quizzes.values())
+
+    def create(self, quiz_id, title):
+        created_at = datetime.now(timezone.utc).isoformat()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("INSERT INTO quizzes (id, title, created_at) VALUES (?, ?, ?)",
+                             (quiz_id, title, created_at))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                raise QuizExists(f"Quiz '{quiz_id}' already exists")
+            finally:
+                conn.close()
+            self._load()
+            return self._quizzes[quiz_id]
+
+    def delete(self, quiz_id):
+        with self._lock:
+            conn = self._connect()
+            try:
+                deleted = conn.execute("DELETE FROM quizzes WHERE id = ?", (quiz_id,)).rowcount
+                conn.commit()
+            finally:
+                conn.close()
+            self._load()
+            return deleted > 0
+
+    def reset(self):
+        # Forgets the cached catalog, e.g. after the data directory changed
+        with self._lock:
+            self._quizzes = None
+            self._created = False
+
+
+def _quiz_to_json(quiz_id, title, created_at):
+    return {
+        "id": quiz_id,
+        "title": title,
+        "createdAt": created_at,
+        "url": "" if quiz_id == db_service.DEFAULT_QUIZ else f"/quizzes/{quiz_id}"
+    }
+
+
+catalog = QuizCatalog()
+
+
+def init_catalog():
+    catalog.init()
+
+
+def get_quiz(quiz_id):
+    """
+    :return: the quiz, or None when there is no such quiz
+    """
+    return catalog.get(quiz_id)
+
+
+def list_quizzes():
+    return catalog.list()
+
+
+def create_quiz(quiz_id, title):
+    """
+    Registers a quiz. Its database is created on its first request.
+    :raise ValueError: invalid id or title, QuizExists when the id is taken
+    """
+    if not isinstance(quiz_id, str) or not QUIZ_ID_PATTERN.match(quiz_id):
+        raise ValueError("Quiz id must be 1 to 64 lowercase letters, digits, '-' or '_'")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("Missing title")
+    return catalog.create(quiz_id, title.strip())
+
+
+def delete_quiz(quiz_id):
+    """
+    Deletes a quiz with its database, images and sessions, once its requests
+    in flight are done. New ones are refused meanwhile.
+    :return: False when there is no such quiz
+    :raise QuizInUse: when its requests did not finish within DELETE_TIMEOUT
+    """
+    if quiz_id == db_service.DEFAULT_QUIZ:
+        raise ValueError("The default quiz cannot be deleted")
+    if catalog.get(quiz_id) is None:
+        return False
+    if not db_service.databases.retire(quiz_id, DELETE_TIMEOUT):
+        raise QuizInUse(f"Quiz '{quiz_id}' is in use, try again later")
+
+    try:
+        if not catalog.delete(quiz_id):
+            return False
+        session_store.forget_quiz(quiz_id)
+        try:
+            shutil.rmtree(os.path.dirname(db_service.quiz_db_path(quiz_id)))
+        except FileNotFoundError:
+            # Never opened: it has no files
+            pass
+    finally:
+        db_service.databases.restore(quiz_id)
+    return True
@@ -0,0 +1,118 @@
+import threading
+from services.db_service import current_database, get_db_connection, release_db_connection
+from services.participation_writer import flush_participations
+
+
+class ScoreRanking:
+    """
+    Number of participations per score, kept in a Fenwick tree so that the
+    rank of a score costs O(log max_score) whatever the number of
+    participations. Seeded lazily from the participations table.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._counts = None
+        self._tree = []
+        self._total = 0
+        self._seeded_id = 0
+
+    def _seed(self):
+        # Lock held by the caller
+        self._seeded_id, self._counts = self._loader()
+        self._total = sum(self._counts.values())
+        self._build(max(self._counts, default=0) + 1)
+
+    def _build(self, size):
+        self._tree = [0] * (size + 1)
+        for score, count in self._counts.items():
+            self._tree_add(score, count)
+
+    def _tree_add(self, score, count):
+        index = score + 1
+        while index < len(self._tree):
+            self._tree[index] += count
+            index += index & -index
+
+    def _count_up_to(self, score):
+        index = min(score + 1, len(self._tree) - 1)
+        count = 0
+        while index > 0:
+            count += self._tree[index]
+            index -= index & -index
+        return count
+
+    def add(self, score, participation_id):
+        with self._lock:
+            # Rows committed before the seed are already counted
+            if self._counts is None or participation_id <= self._seeded_id:
+                return
+
+            self._counts[score] = self._counts.get(score, 0) + 1
+            self._total += 1
+            if score + 1 >= len(self._tree):
+                self._build(max(2 * len(self._tree), score + 2))
+            else:
+                self._tree_add(score, 1)
+
+    def rank(self, score):
+        """
+        :return: (rank, percentile, total) of a score. The rank is 1 + the
+        number of better scores, the percentile the share of participations
+        scoring at most as much.
+        """
+        with self._lock:
+            if self._counts is None:
+                self._seed()
+
+            if self._total == 0:
+                return 1, 100.0, 0
+
+            at_most = self._count_up_to(score)
+            better = self._total - at_most
+            return better + 1, round(100 * at_most / self._total, 1), self._total
+
+    def total(self):
+        with self._lock:
+            if self._counts is None:
+                self._seed()
+            return self._total
+
+    def reset(self):
+        with self._lock:
+            self._counts = None
+            self._tree = []
+            self._total = 0
+            self._seeded_id = 0
+
+
+def _load_score_counts():
+    # Queued participations must be in the table before it is counted
+    flush_participations()
+
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("BEGIN")
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM participations")
+        (last_id,) = cur.fetchone()
+        cur.execute("SELECT score, COUNT(*) FROM participations GROUP BY score")
+        counts = dict(cur.fetchall())
+        cur.execute("COMMIT")
+        return last_id, counts
+
+    except Exception as e:
+        cur.execute("ROLLBACK")
+        raise e
+
+    finally:
+        release_db_connection(conn)
+
+
+def get_score_ranking():
+    """
+    :return: the score ranking of the current quiz
+    """
+    return current_database().attach("score_ranking", lambda: ScoreRanking(_load_score_counts))
@@ -1,43 +1,40 @@
-import os
-import sqlite3
-DB_NAME = "quiz-db.db"
+from services.db_service import get_db_connection, release_db_connection
+from services.migration_service import run_migrations
+from services.question_service import invalidate_quiz_cache, bump_participations_version
+from services.rank_service import get_score_ranking
+from services.stats_service import forget_layouts, get_quiz_stats
+from services.participation_writer import flush_participations, reset_participation_ids
+from services.metrics_service import timed
+from services.image_service import delete_all_image_files
 
-SCHEMA = """
+DROP_SCHEMA = """
 DROP TABLE IF EXISTS answers;
+DROP TABLE IF EXISTS answer_layouts;
+DROP TABLE IF EXISTS stats_scores;
+DROP TABLE IF EXISTS stats_activity;
+DROP TABLE IF EXISTS stats_questions;
+DROP TABLE IF EXISTS stats_checkpoint;
 DROP TABLE IF EXISTS participations;
 DROP TABLE IF EXISTS questions;
-
-CREATE TABLE "questions" (
-	"id" INTEGER PRIMARY KEY AUTOINCREMENT,
-	"title" TEXT NOT NULL,
-	"position" INTEGER NOT NULL,
-	"text" TEXT NOT NULL,
-	"image" BLOB NOT NULL
-);
-
-CREATE TABLE "answers" (
-	"id" INTEGER PRIMARY KEY AUTOINCREMENT,
-	"question_id" INTEGER NOT NULL,
-	"text" TEXT NOT NULL,
-	"is_correct" INTEGER NOT NULL,
-	"latitude" REAL,
-	"longitude" REAL,
-	FOREIGN KEY("question_id") REFERENCES "questions"("id") ON DELETE CASCADE
-);
-
-CREATE TABLE "participations" (
-	"id" INTEGER PRIMARY KEY AUTOINCREMENT,
-	"player_name" TEXT NOT NULL,
-	"score" INTEGER NOT NULL,
-	"date" TEXT NOT NULL
-);
+DROP TABLE IF EXISTS images;
+PRAGMA user_version = 0;
 """
 
+@timed
 def rebuild_database():
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
+    flush_participations()
+
+    conn = get_db_connection()
+    try:
+        conn.executescript(DROP_SCHEMA)
+    finally:
+        release_db_connection(conn)
+    delete_all_image_files()
 
-    conn = sqlite3.connect(DB_NAME)
-    conn.executescript(SCHEMA)
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    run_migrations()
+    reset_participation_ids()
+    invalidate_quiz_cache()
+    get_score_ranking().reset()
+    get_quiz_stats().reset()
+    forget_layouts()
+    bump_participations_version()
@@ -0,0 +1,250 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from services.db_service import current_database
+from services.question_service import get_quiz_snapshot, score_answer, record_participation
+from services.metrics_service import register_collector, timed
+
+# Sessions idle for longer than this are dropped (and counted as abandoned)
+SESSION_TTL = float(os.environ.get("QUIZ_SESSION_TTL_S", "1800"))
+# Oldest sessions are dropped beyond this many, to bound memory
+SESSION_MAX = int(os.environ.get("QUIZ_SESSION_MAX", "100000"))
+
+
+class SessionConflict(ValueError):
+    """The request does not match the state of the session."""
+
+
+class QuizSession:
+    __slots__ = ('id', 'quiz_id', 'player_name', 'scoring_key', 'question_ids', 'size', 'answered', 'score', 'points',
+                 'last_seen')
+
+    def __init__(self, session_id, quiz_id, player_name, scoring_key, question_ids):
+        self.id = session_id
+        self.quiz_id = quiz_id
+        self.player_name = player_name
+        # The snapshot's: answers are scored against the quiz it started on
+        self.scoring_key = scoring_key
+        # Shared with the snapshot the session started on
+        self.question_ids = question_ids
+        self.size = len(question_ids)
+        self.answered = 0
+        self.score = 0
+        # Points of each answer, for the stats
+        self.points = []
+        self.last_seen = time.monotonic()
+
+
+class SessionCounters:
+    """How far the players of one quiz get, for drop-off analytics."""
+    __slots__ = ('active', 'started', 'finished', 'expired', 'answered', 'abandoned')
+
+    def __init__(self):
+        self.active = 0
+        self.started = 0
+        self.finished = 0
+        self.expired = 0
+        # position -> sessions that answered it / that stopped after it
+        self.answered = {}
+        self.abandoned = {}
+
+
+class SessionStore:
+    """
+    In-memory quiz sessions of every quiz, least recently used first, with
+    TTL eviction. Also counts how far players get, per quiz. Sessions are not
+    kept with the quiz database: they survive its eviction.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        # quiz id -> SessionCounters
+        self._counters = {}
+        self.started = 0
+        self.finished = 0
+        self.expired = 0
+
+    def _quiz_counters(self, quiz_id):
+        # Lock held by the caller
+        counters = self._counters.get(quiz_id)
+        if counters is None:
+            counters = self._counters[quiz_id] = SessionCounters()
+        return counters
+
+    def _evict(self, now):
+        # Lock held by the caller
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_seen > now - self.ttl and len(self._sessions) <= self.max_sessions:
+                return
+            del self._sessions[session.id]
+            self.expired += 1
+            counters = self._quiz_counters(session.quiz_id)
+            counters.active -= 1
+            counters.expired += 1
+            counters.abandoned[session.answered] = counters.abandoned.get(session.answered, 0) + 1
+
+    def _get(self, session_id, quiz_id):
+        # Lock held by the caller. A session of another quiz is unknown here.
+        session = self._sessions.get(session_id)
+        if session is None or session.quiz_id != quiz_id:
+            return None
+        return session
+
+    def start(self, quiz_id, player_name, scoring_key, question_ids):
+        session = QuizSession(secrets.token_urlsafe(16), quiz_id, player_name, scoring_key, question_ids)
+        with self._lock:
+            self._sessions[session.id] = session
+            self.started += 1
+            counters = self._quiz_counters(quiz_id)
+            counters.active += 1
+            counters.started += 1
+            self._evict(session.last_seen)
+        return session
+
+    def answer(self, session_id, quiz_id, position, score):
+        """
+        Records the answer to the next question of a session.
+        :param score: callable(session) returning the points of the answer
+        :return: (session, points), or None when unknown or expired
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._get(session_id, quiz_id)
+            if session is None:
+                return None
+            if session.answered >= session.size:
+                raise SessionConflict("All questions are already answered")
+            if position != session.answered + 1:
+                raise SessionConflict(f"Expected an answer for position {session.answered + 1}")
+
+            points = score(session)
+            session.answered = position
+            session.score += points
+            session.points.append(points)
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+            answered = self._quiz_counters(quiz_id).answered
+            answered[position] = answered.get(position, 0) + 1
+            return session, points
+
+    def finish(self, session_id, quiz_id):
+        """
+        Removes a session once every question is answered.
+        :return: the session, or None when unknown or expired
+        """
+        with self._lock:
+            self._evict(time.monotonic())
+            session = self._get(session_id, quiz_id)
+            if session is None:
+                return None
+            if session.answered < session.size:
+                raise SessionConflict(f"Quiz not finished: {session.answered}/{session.size} questions answered")
+
+            del self._sessions[session_id]
+            self.finished += 1
+            counters = self._quiz_counters(quiz_id)
+            counters.active -= 1
+            counters.finished += 1
+            return session
+
+    def stats(self, quiz_id):
+        with self._lock:
+            self._evict(time.monotonic())
+            counters = self._quiz_counters(quiz_id)
+            return {
+                "active": counters.active,
+                "started": counters.started,
+                "finished": counters.finished,
+                "expired": counters.expired,
+                "answered": [{"position": position, "count": count}
+                             for position, count in sorted(counters.answered.items())],
+                "abandonedAfter": [{"position": position, "count": count}
+                                   for position, count in sorted(counters.abandoned.items())],
+            }
+
+    def forget_quiz(self, quiz_id):
+        """
+        Drops the sessions and counters of a deleted quiz.
+        """
+        with self._lock:
+            for session in [session for session in self._sessions.values() if session.quiz_id == quiz_id]:
+                del self._sessions[session.id]
+            self._counters.pop(quiz_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+session_store = SessionStore()
+
+
+def start_session(player_name):
+    snapshot = get_quiz_snapshot()
+    session = session_store.start(current_database().id, player_name, snapshot.scoring_key, snapshot.question_ids)
+    return {"sessionId": session.id, "size": session.size, "position": 1, "ttl": session_store.ttl}
+
+
+@timed
+def answer_session_question(session_id, position, submitted_answer):
+    """
+    Scores one answer and adds it to the session total.
+    :return: the points and running score, or None for an unknown session
+    """
+    snapshot = get_quiz_snapshot()
+
+    def score(session):
+        if session.scoring_key != snapshot.scoring_key:
+            raise SessionConflict("The quiz changed, please start again")
+        return score_answer(snapshot.answer_key, position, submitted_answer, snapshot.geo_key)
+
+    result = session_store.answer(session_id, current_database().id, position, score)
+    if result is None:
+        return None
+
+    session, points = result
+    flags = snapshot.answer_key.get(position, ())
+    return {
+        "position": position,
+        "points": points,
+        "correct": points > 0,
+        # Revealed once answered: the bundle has no correctness flags
+        "correctAnswer": flags.index(True) + 1 if True in flags else None,
+        "score": session.score,
+        "finished": session.answered == session.size
+    }
+
+
+@timed
+def finalize_session(session_id):
+    """
+    Stores the participation of a finished session: the score is already
+    known, nothing is re-read or re-scored.
+    :return: same as create_participation_handler, or None for an unknown session
+    """
+    session = session_store.finish(session_id, current_database().id)
+    if session is None:
+        return None
+    return record_participation(session.player_name, session.score, session.question_ids, session.points)
+
+
+def get_session_stats():
+    return session_store.stats(current_database().id)
+
+
+def _collect_metrics():
+    return [
+        ("quiz_sessions_active", "gauge", "Quiz sessions in progress.", len(session_store)),
+        ("quiz_sessions_started_total", "counter", "Quiz sessions started.", session_store.started),
+        ("quiz_sessions_finished_total", "counter", "Quiz sessions finalized.", session_store.finished),
+        ("quiz_sessions_expired_total", "counter", "Quiz sessions dropped unfinished.", session_store.expired),
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,450 @@
+"""
+Quiz analytics: the points of every answer, stored compactly with each
+participation, and aggregates kept in memory and checkpointed to tables, so
+that the stats never scan the history. Rebuild the aggregates from the history with:
+
+    python -m services.stats_service [--quiz <id>]
+"""
+import argparse
+import array
+import sys
+import logging
+import os
+import threading
+from services import db_service, participation_writer
+from services.db_service import current_database, get_db_connection, release_db_connection, use_database, use_quiz
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Participations after which the aggregate tables catch up
+CHECKPOINT_INTERVAL = int(os.environ.get("QUIZ_STATS_CHECKPOINT", "10000"))
+# Rows read per batch when aggregating
+AGGREGATE_BATCH_SIZE = 50000
+
+logger = logging.getLogger(__name__)
+
+
+def _to_bytes(typecode, values):
+    data = array.array(typecode, values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _from_bytes(typecode, blob):
+    data = array.array(typecode)
+    data.frombytes(blob)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
+
+
+def encode_question_ids(question_ids):
+    # Little-endian uint32, one per position
+    return _to_bytes("I", question_ids)
+
+
+def decode_question_ids(blob):
+    return tuple(_from_bytes("I", blob))
+
+
+def encode_points(points):
+    """
+    :return: the points of each answer, one byte each, two when an answer
+    scored more than 255 (the width is told by the blob length)
+    """
+    return _to_bytes("B" if max(points, default=0) < 256 else "H", points)
+
+
+def decode_points(blob, size):
+    return _from_bytes("B" if len(blob) == size else "H", blob)
+
+
+class Aggregates:
+    """Participations per score and per hour, answers per question."""
+
+    def __init__(self):
+        self.scores = {}
+        # 'YYYY-MM-DDTHH' (UTC) -> participations, oldest first
+        self.hours = {}
+        # question id -> [answered, correct, points]
+        self.questions = {}
+
+    def add(self, score, date, question_ids=None, points=None):
+        self.scores[score] = self.scores.get(score, 0) + 1
+        hour = date[:13]
+        self.hours[hour] = self.hours.get(hour, 0) + 1
+        if question_ids is not None:
+            self.add_answers(question_ids, points)
+
+    def add_answers(self, question_ids, points):
+        questions = self.questions
+        for question_id, value in zip(question_ids, points):
+            counts = questions.get(question_id)
+            if counts is None:
+                counts = questions[question_id] = [0, 0, 0]
+            counts[0] += 1
+            counts[1] += value > 0
+            counts[2] += value
+
+    def add_question(self, question_id, answered, correct, points):
+        counts = self.questions.get(question_id)
+        if counts is None:
+            counts = self.questions[question_id] = [0, 0, 0]
+        counts[0] += answered
+        counts[1] += correct
+        counts[2] += points
+
+
+def answer_columns(question_ids, points):
+    """
+    The question ids of a quiz version are stored once, as a layout shared
+    by the answers of its participations, and its id remembered. A new
+    layout is committed on its own: call outside of a write transaction, a
+    rollback then never leaves a remembered id behind.
+    :return: (layout id, points) to store with a participation, (None, None)
+    when its answers are unknown
+    """
+    if question_ids is None:
+        return None, None
+    layouts = current_database().attach("answer_layouts", dict)
+    layout_id = layouts.get(question_ids)
+    if layout_id is None:
+        blob = encode_question_ids(question_ids)
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("INSERT OR IGNORE INTO answer_layouts (question_ids) VALUES (?)", (blob,))
+            cur.execute("SELECT id FROM answer_layouts WHERE question_ids = ?", (blob,))
+            layout_id = layouts[question_ids] = cur.fetchone()[0]
+        finally:
+            release_db_connection(conn)
+    return layout_id, encode_points(points)
+
+
+def forget_layouts():
+    # After the tables of the current quiz were dropped
+    current_database().attach("answer_layouts", dict).clear()
+
+
+def delete_stats(cur):
+    # Within the caller's transaction, with the participations. Layouts stay:
+    # they are remembered, and do not grow with the participations.
+    for table in ("stats_scores", "stats_activity", "stats_questions", "stats_checkpoint"):
+        cur.execute(f"DELETE FROM {table}")
+
+
+def _aggregate_answers(rows, layouts, aggregates):
+    """
+    Adds (layout id, points) rows to the per-question counts: rows of the same
+    layout and width are stacked in a matrix, one column per question, and
+    summed in vectorized passes.
+    """
+    groups = {}
+    for layout_id, blob in rows:
+        groups.setdefault((layout_id, len(blob)), []).append(blob)
+
+    for (layout_id, width), blobs in groups.items():
+        question_ids = layouts[layout_id]
+        if not question_ids:
+            continue
+        dtype = "<u1" if width == len(question_ids) else "<u2"
+        matrix = np.frombuffer(b"".join(blobs), dtype=dtype).reshape(len(blobs), len(question_ids))
+        correct = np.count_nonzero(matrix, axis=0)
+        points = matrix.sum(axis=0, dtype=np.int64)
+        for question_id, column_correct, column_points in zip(question_ids, correct.tolist(), points.tolist()):
+            aggregates.add_question(question_id, len(blobs), column_correct, column_points)
+
+
+def _aggregate(cur, after_id, through_id):
+    """
+    :return: Aggregates of the participations after_id < id <= through_id and
+    of their answers, read in batches
+    """
+    aggregates = Aggregates()
+
+    cur.execute("SELECT id, question_ids FROM answer_layouts")
+    layouts = {layout_id: decode_question_ids(blob) for layout_id, blob in cur.fetchall()}
+
+    cur.execute("""
+        SELECT score, date, layout_id, points FROM participations
+        WHERE id > ? AND id <= ?
+    """, (after_id, through_id))
+    while True:
+        rows = cur.fetchmany(AGGREGATE_BATCH_SIZE)
+        if not rows:
+            break
+        if np is None:
+            for score, date, layout_id, points in rows:
+                if layout_id is None:
+                    aggregates.add(score, date)
+                else:
+                    question_ids = layouts[layout_id]
+                    aggregates.add(score, date, question_ids, decode_points(points, len(question_ids)))
+            continue
+
+        scores = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        lowest = int(scores.min())
+        counts = np.bincount(scores - lowest)
+        for offset in np.flatnonzero(counts).tolist():
+            aggregates.scores[lowest + offset] = aggregates.scores.get(lowest + offset, 0) + int(counts[offset])
+        # Truncating the ISO dates to 13 characters buckets them by hour
+        hours, hour_counts = np.unique(np.array([row[1] for row in rows], dtype="U13"), return_counts=True)
+        for hour, count in zip(hours.tolist(), hour_counts.tolist()):
+            aggregates.hours[hour] = aggregates.hours.get(hour, 0) + count
+        _aggregate_answers([row[2:] for row in rows if row[2] is not None], layouts, aggregates)
+
+    return aggregates
+
+
+def _checkpoint(cur):
+    """
+    Adds the participations stored since the last checkpoint to the aggregate
+    tables, within the caller's write transaction.
+    :return: id of the last participation counted
+    """
+    cur.execute("SELECT COALESCE(MAX(through_id), 0) FROM stats_checkpoint")
+    (through_id,) = cur.fetchone()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM participations")
+    (last_id,) = cur.fetchone()
+    if last_id <= through_id:
+        return through_id
+
+    batch = _aggregate(cur, through_id, last_id)
+    cur.executemany("""
+        INSERT INTO stats_scores (score, count) VALUES (?, ?)
+        ON CONFLICT (score) DO UPDATE SET count = count + excluded.count
+    """, batch.scores.items())
+    cur.executemany("""
+        INSERT INTO stats_activity (hour, count) VALUES (?, ?)
+        ON CONFLICT (hour) DO UPDATE SET count = count + excluded.count
+    """, batch.hours.items())
+    cur.executemany("""
+        INSERT INTO stats_questions (question_id, answered, correct, points) VALUES (?, ?, ?, ?)
+        ON CONFLICT (question_id) DO UPDATE SET
+            answered = answered + excluded.answered,
+            correct = correct + excluded.correct,
+            points = points + excluded.points
+    """, [(question_id, *counts) for question_id, counts in batch.questions.items()])
+    cur.execute("INSERT OR REPLACE INTO stats_checkpoint (id, through_id) VALUES (1, ?)", (last_id,))
+    return last_id
+
+
+def _read_aggregates(cur):
+    aggregates = Aggregates()
+    cur.execute("SELECT score, count FROM stats_scores ORDER BY score")
+    aggregates.scores = dict(cur.fetchall())
+    cur.execute("SELECT hour, count FROM stats_activity ORDER BY hour")
+    aggregates.hours = dict(cur.fetchall())
+    cur.execute("SELECT question_id, answered, correct, points FROM stats_questions")
+    aggregates.questions = {row[0]: list(row[1:]) for row in cur.fetchall()}
+    return aggregates
+
+
+def _in_write_transaction(work):
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        result = work(cur)
+        cur.execute("COMMIT")
+        return result
+
+    except Exception as e:
+        if conn.in_transaction:
+            cur.execute("ROLLBACK")
+        raise e
+
+    finally:
+        release_db_connection(conn)
+
+
+def checkpoint_stats():
+    """
+    Catches the aggregate tables of the current quiz up with the
+    participations stored since the last checkpoint.
+    :return: id of the last participation counted
+    """
+    return _in_write_transaction(_checkpoint)
+
+
+def _load_stats():
+    # Queued participations must be in the tables before they are counted
+    participation_writer.flush_participations()
+    return _in_write_transaction(lambda cur: (_checkpoint(cur), _read_aggregates(cur)))
+
+
+class QuizStats:
+    """
+    In-memory copy of the aggregates of a quiz, seeded lazily from the
+    aggregate tables then updated with each participation: reading them
+    costs the size of the aggregates, never of the history.
+
+    Storing a participation writes its row only; the tables catch up every
+    CHECKPOINT_INTERVAL participations, and when seeded, from the rows
+    stored since their last checkpoint.
+    """
+
+    def __init__(self, database, checkpoint_interval=CHECKPOINT_INTERVAL):
+        self.database = database
+        self.checkpoint_interval = checkpoint_interval
+        self._lock = threading.Lock()
+        self._aggregates = None
+        self._seeded_id = 0
+        self._hours_sorted = True
+        # Participations added since the last checkpoint
+        self._pending = 0
+        self._checkpointing = False
+
+    def _get(self):
+        # Lock held by the caller
+        if self._aggregates is None:
+            with use_database(self.database):
+                self._seeded_id, self._aggregates = _load_stats()
+            self._hours_sorted = True
+            self._pending = 0
+        return self._aggregates
+
+    def add(self, participation_id, score, date, question_ids=None, points=None):
+        with self._lock:
+            # Rows committed before the seed are already counted
+            if self._aggregates is not None and participation_id > self._seeded_id:
+                hours = self._aggregates.hours
+                hour = date[:13]
+                if hours and hour not in hours and hour < next(reversed(hours)):
+                    self._hours_sorted = False
+                self._aggregates.add(score, date, question_ids, points)
+
+            self._pending += 1
+            if self._pending < self.checkpoint_interval or self._checkpointing:
+                return
+            self._pending = 0
+            self._checkpointing = True
+
+        # Outside the lock: the reads of the stats do not wait for it
+        try:
+            with use_database(self.database):
+                checkpoint_stats()
+        except Exception:
+            # The participation is stored: the next checkpoint catches up
+            logger.exception("Error checkpointing the stats of quiz %s", self.database.id)
+        finally:
+            self._checkpointing = False
+
+    def scores(self):
+        """
+        :return: participations, mean and best score, and participations per score
+        """
+        with self._lock:
+            scores = self._get().scores
+            total = sum(scores.values())
+            return {
+                "participations": total,
+                "meanScore": round(sum(score * count for score, count in scores.items()) / total, 3) if total else None,
+                "maxScore": max(scores, default=None),
+                "scores": [{"score": score, "count": count} for score, count in sorted(scores.items())],
+            }
+
+    def questions(self, questions):
+        """
+        :param questions: the questions of the quiz, in position order
+        :return: answers, correct answers and mean points of each question
+        """
+        with self._lock:
+            counts = self._get().questions
+            result = []
+            for question in questions:
+                answered, correct, points = counts.get(question.id, (0, 0, 0))
+                result.append({
+                    "questionId": question.id,
+                    "position": question.position,
+                    "title": question.title,
+                    "answered": answered,
+                    "correct": correct,
+                    "correctRate": round(correct / answered, 4) if answered else None,
+                    "meanPoints": round(points / answered, 3) if answered else None,
+                })
+            return result
+
+    def activity(self, bucket="hour", limit=48):
+        """
+        :return: participations of the last `limit` hours or days with any, oldest first
+        """
+        with self._lock:
+            aggregates = self._get()
+            if not self._hours_sorted:
+                aggregates.hours = dict(sorted(aggregates.hours.items()))
+                self._hours_sorted = True
+
+            width = 13 if bucket == "hour" else 10
+            periods = []
+            for hour, count in reversed(aggregates.hours.items()):
+                period = hour[:width]
+                if periods and periods[-1][0] == period:
+                    periods[-1][1] += count
+                elif len(periods) < limit:
+                    periods.append([period, count])
+                else:
+                    break
+            return [{"period": period, "count": count} for period, count in reversed(periods)]
+
+    def reset(self):
+        with self._lock:
+            self._aggregates = None
+            self._seeded_id = 0
+
+
+def get_quiz_stats():
+    """
+    :return: the aggregates of the current quiz
+    """
+    database = current_database()
+    return database.attach("quiz_stats", lambda: QuizStats(database))
+
+
+def _rebuild(cur):
+    for table in ("stats_scores", "stats_activity", "stats_questions", "stats_checkpoint"):
+        cur.execute(f"DELETE FROM {table}")
+    _checkpoint(cur)
+    cur.execute("SELECT COALESCE(SUM(count), 0) FROM stats_scores")
+    return cur.fetchone()[0]
+
+
+def rebuild_stats():
+    """
+    Recomputes the aggregate tables of the current quiz from the whole
+    history, in one write transaction, with vectorized passes when numpy is
+    installed.
+    :return: number of participations counted
+    """
+    participation_writer.flush_participations()
+    count = _in_write_transaction(_rebuild)
+    # Reseeded from the rebuilt tables on next use
+    get_quiz_stats().reset()
+    return count
+
+
+def main(argv=None):
+    from services.migration_service import run_migrations
+    from services.quiz_service import get_quiz
+
+    parser = argparse.ArgumentParser(prog="python -m services.stats_service",
+                                     description="Rebuild the quiz stats from the participations")
+    parser.add_argument("--quiz", default=db_service.DEFAULT_QUIZ, help="quiz id (default: the default quiz)")
+    args = parser.parse_args(argv)
+    if get_quiz(args.quiz) is None:
+        parser.error(f"unknown quiz: {args.quiz}")
+
+    with use_quiz(args.quiz):
+        run_migrations()
+        count = rebuild_stats()
+    print(f"Rebuilt the stats of quiz '{args.quiz}' from {count} participations"
+          + ("" if np is not None else " (without numpy)"))
+
+
+if __name__ == "__main__":
+    main()
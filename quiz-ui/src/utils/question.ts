@@ -8,7 +8,7 @@ export interface Question {
 }
 
 export interface Answer {
-  isCorrect: boolean;
+  isCorrect?: boolean;
   text: string;
   latitude?: number;
   longitude?: number;